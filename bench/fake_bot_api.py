@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import time
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'Bench',
+    'username': 'bench_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+
+class FakeBotApi:
+    # Локальная заглушка Bot API: записывает отправленные сообщения и умеет имитировать ошибки Telegram
+    def __init__(self, latency=0.0, retry_after_every=0, retry_after=1, forbidden_every=0):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.forbidden_every = forbidden_every
+        self.sent = []
+        self.calls = {}
+        self.errors = {}
+        self.send_counter = 0
+        self.message_ids = itertools.count(1)
+        self.runner = None
+        self.url = None
+
+    def reset(self):
+        self.sent.clear()
+        self.calls.clear()
+        self.errors.clear()
+        self.send_counter = 0
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/_stats', self.handle_stats)
+        app.router.add_post('/_config', self.handle_config)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return self.ok(True)
+        response = handler(data)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+    async def handle_stats(self, request):
+        # Статистика для бенчмарка: вызовы методов, ошибки и моменты отправки сообщений
+        return web.json_response({
+            'calls': self.calls,
+            'errors': self.errors,
+            'sent': [sent_at for sent_at, _ in self.sent],
+        })
+
+    async def handle_config(self, request):
+        # Настройка имитируемых ошибок и задержки; статистика сбрасывается
+        config = await request.json()
+        for name in ('latency', 'retry_after_every', 'retry_after', 'forbidden_every'):
+            if name in config:
+                setattr(self, name, config[name])
+        self.reset()
+        return web.json_response({'ok': True})
+
+    def ok(self, result):
+        return web.json_response({'ok': True, 'result': result})
+
+    def error(self, code, description, parameters=None):
+        self.errors[code] = self.errors.get(code, 0) + 1
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+    def message(self, chat_id, text=None):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if text is not None:
+            message['text'] = text
+        return message
+
+    def api_getMe(self, data):
+        return self.ok(BOT_USER)
+
+    async def api_getUpdates(self, data):
+        # Имитация long polling: обновлений нет, ответ приходит по таймауту
+        await asyncio.sleep(min(float(data.get('timeout') or 0), 1.0))
+        return self.ok([])
+
+    def api_sendMessage(self, data):
+        self.send_counter += 1
+        chat_id = int(data['chat_id'])
+        if self.retry_after_every and self.send_counter % self.retry_after_every == 0:
+            return self.error(429, f"Too Many Requests: retry after {self.retry_after}", {'retry_after': self.retry_after})
+        if self.forbidden_every and chat_id % self.forbidden_every == 0:
+            return self.error(403, "Forbidden: bot was blocked by the user")
+        self.sent.append((time.time(), chat_id))
+        return self.ok(self.message(chat_id, data.get('text')))
+
+    def api_sendDocument(self, data):
+        self.sent.append((time.time(), int(data['chat_id'])))
+        return self.ok(self.message(data['chat_id']))
+
+    def api_editMessageText(self, data):
+        return self.ok(self.message(data.get('chat_id', 0), data.get('text')))
+
+
+class FakeBotApiProcess:
+    # Заглушка в отдельном процессе, чтобы она не делила event loop и CPU с измеряемым ботом
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.0):
+        self.url = f"http://{host}:{port}"
+        self.process = multiprocessing.Process(target=serve, args=(host, port, latency), daemon=True)
+
+    async def start(self):
+        self.process.start()
+        async with aiohttp.ClientSession() as session:
+            for _ in range(100):
+                try:
+                    async with session.get(f"{self.url}/_stats"):
+                        return self.url
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.05)
+        raise RuntimeError("Заглушка Bot API не запустилась")
+
+    async def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+    async def configure(self, **config):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.url}/_config", json=config) as response:
+                response.raise_for_status()
+
+    async def stats(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.url}/_stats") as response:
+                return await response.json()
+
+
+def serve(host, port, latency):
+    async def run():
+        api = FakeBotApi(latency)
+        await api.start(host, port)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument('--retry-after-every', type=int, default=0, help="каждый N-й sendMessage отвечает 429")
+    parser.add_argument('--forbidden-every', type=int, default=0, help="чаты с chat_id, кратным N, отвечают 403")
+    args = parser.parse_args()
+    api = FakeBotApi(args.latency, args.retry_after_every, forbidden_every=args.forbidden_every)
+    url = await api.start(args.host, args.port)
+    print(f"Заглушка Bot API слушает {url} (TELEGRAM_API_URL={url})")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            print(json.dumps({'calls': api.calls, 'errors': api.errors, 'sent': len(api.sent)}, ensure_ascii=False))
+    finally:
+        await api.stop()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Лимиты рассылки в бенчмарке по умолчанию сняты: измеряется сам движок, а не лимиты Telegram
+os.environ.setdefault('BROADCAST_RATE', '100000')
+os.environ.setdefault('BROADCAST_PER_CHAT_RATE', '1000')
+os.environ.setdefault('BROADCAST_CONCURRENCY', '64')
+os.environ.setdefault('BROADCAST_QUEUE_SIZE', '10000')
+os.environ.setdefault('METRICS_PORT', '')
+
+from telegram import Update  # noqa: E402
+
+import mybot  # noqa: E402
+from fake_bot_api import FakeBotApiProcess  # noqa: E402
+from scheduler import OnceTrigger  # noqa: E402
+from storage import Repository  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+TOKEN = '1:bench'
+TIMEZONES = ['Europe/Moscow', 'Europe/London', 'Asia/Yekaterinburg', 'America/New_York']
+# Чат, из которого отправляется /notify: отрицательный id не делится нацело на forbidden_every,
+# поэтому заглушка не ответит 403 на ответы боту отправителю и отчет о рассылке дойдет
+SENDER_CHAT_ID = -1
+
+
+def percentiles(values, scale=1000.0):
+    # p50/p95/p99 в миллисекундах
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * scale, 3)
+
+    return {
+        'count': len(values),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(values[-1] * scale, 3),
+    }
+
+
+class Updates:
+    # Генератор синтетических обновлений Telegram
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def message(self, chat_id, text):
+        self.update_id += 1
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': self.update_id, 'message': message}
+
+
+async def seed(workdir, chats=0, tasks=0, notifications=0):
+    # Наполнение баз тестовыми данными напрямую, минуя бота
+    repo = Repository(os.path.join(workdir, 'tasks.db'), os.path.join(workdir, 'notifications.db'))
+    repo.create_tables()
+    await repo.close()
+    rng = random.Random(42)
+    with sqlite3.connect(os.path.join(workdir, 'tasks.db')) as conn:
+        conn.executemany('INSERT OR IGNORE INTO chats (id) VALUES (?)', ((i,) for i in range(1, chats + 1)))
+        conn.executemany('INSERT INTO tasks (task) VALUES (?)', ((f"Задача {i}",) for i in range(tasks)))
+    with sqlite3.connect(os.path.join(workdir, 'notifications.db')) as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO notifications (chat_id, time, tz) VALUES (?, ?, ?)',
+            ((rng.randint(1, max(chats, 1)), f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}", rng.choice(TIMEZONES)) for _ in range(notifications)),
+        )
+
+
+async def open_bot(api):
+    bot = mybot.NotificationBot(TOKEN, mode='polling', api_url=api.url)
+    await bot.application.initialize()
+    await bot.broadcaster.start()
+    return bot
+
+
+async def close_bot(bot):
+    await bot.metrics.stop()
+    await bot.outbox.stop()
+    await bot.broadcaster.stop()
+    await bot.application.shutdown()
+    await bot.persistence.close()
+    await bot.repo.close()
+
+
+async def process(bot, data):
+    update = Update.de_json(data, bot.application.bot)
+    started = time.perf_counter()
+    await bot.application.process_update(update)
+    return time.perf_counter() - started
+
+
+async def wait_background(before):
+    # Ожидание фоновых задач, запущенных обработчиками (например, рассылки /notify)
+    tasks = asyncio.all_tasks() - before - {asyncio.current_task()}
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def scenario_commands(api, args):
+    # Обработка команд /addtask, /listtasks, /closetask
+    bot = await open_bot(api)
+    updates = Updates()
+    latencies = {'addtask': [], 'listtasks': [], 'closetask': []}
+    started = time.perf_counter()
+    for i in range(args.commands):
+        chat_id = 1000 + i % 50
+        latency = await process(bot, updates.message(chat_id, '/addtask'))
+        latency += await process(bot, updates.message(chat_id, f"Задача {i}"))
+        latencies['addtask'].append(latency)
+        latencies['listtasks'].append(await process(bot, updates.message(chat_id, '/listtasks')))
+        if i % 2:
+            latencies['closetask'].append(await process(bot, updates.message(chat_id, f"/closetask {i}")))
+    elapsed = time.perf_counter() - started
+    await close_bot(bot)
+    total = sum(len(values) for values in latencies.values()) + args.commands
+    return {
+        'updates': total,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_ups': round(total / elapsed, 1),
+        'latency': {name: percentiles(values) for name, values in latencies.items()},
+    }
+
+
+async def scenario_broadcast(api, args, workdir):
+    # Полная рассылка /notify по всем чатам
+    await seed(workdir, chats=args.chats, tasks=20)
+    bot = await open_bot(api)
+    updates = Updates()
+    # Около 1% чатов отвечают 403, несколько отправок получают RetryAfter
+    await api.configure(forbidden_every=101, retry_after_every=args.chats // 4 or 0)
+    started = time.time()
+    before = asyncio.all_tasks()
+    await process(bot, updates.message(SENDER_CHAT_ID, '/notify'))
+    await wait_background(before)
+    elapsed = time.time() - started
+    stats = await api.stats()
+    await api.configure(forbidden_every=0, retry_after_every=0)
+    remaining = len(await bot.repo.get_chat_ids())
+    await close_bot(bot)
+    delivery = [sent_at - started for sent_at in stats['sent']]
+    return {
+        'chats': args.chats,
+        'elapsed_s': round(elapsed, 3),
+        'messages_sent': len(delivery),
+        'throughput_mps': round(len(delivery) / elapsed, 1),
+        'errors': stats['errors'],
+        'chats_pruned': args.chats - remaining,
+        'delivery_time': percentiles(delivery),
+    }
+
+
+async def scenario_concurrent(api, args, workdir):
+    # /listtasks из многих чатов во время рассылки /notify: обновления идут через очередь и ChatOrderedUpdateProcessor
+    await seed(workdir, chats=args.chats, tasks=20)
+    bot = await open_bot(api)
+    processor = bot.application.update_processor
+    do_process_update = processor.do_process_update
+    latencies = []
+
+    async def timed(update, coroutine):
+        started = time.perf_counter()
+        await do_process_update(update, coroutine)
+        latencies.append(time.perf_counter() - started)
+
+    processor.do_process_update = timed
+    before = asyncio.all_tasks()
+    await bot.application.start()
+    updates = Updates()
+    started = time.perf_counter()
+    await bot.application.update_queue.put(Update.de_json(updates.message(SENDER_CHAT_ID, '/notify'), bot.application.bot))
+    for i in range(args.commands):
+        await bot.application.update_queue.put(Update.de_json(updates.message(1000 + i % 50, '/listtasks'), bot.application.bot))
+    while len(latencies) < args.commands + 1:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await bot.application.stop()
+    await wait_background(before)
+    broadcast = time.perf_counter() - started
+    await close_bot(bot)
+    return {
+        'updates': args.commands + 1,
+        'workers': processor.workers,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_ups': round((args.commands + 1) / elapsed, 1),
+        'broadcast_s': round(broadcast, 3),
+        'latency': percentiles(latencies),
+    }
+
+
+async def scenario_search(api, args, workdir):
+    # /findtask по большой таблице задач: слова с частотой по закону Ципфа, как в обычном тексте
+    await seed(workdir)
+    rng = random.Random(42)
+    vocabulary = [''.join(rng.choice('абвгдежзиклмнопрстуфхцч') for _ in range(rng.randint(3, 10))) for _ in range(5000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    with sqlite3.connect(os.path.join(workdir, 'tasks.db')) as conn:
+        conn.executemany('INSERT INTO tasks (task) VALUES (?)', ((' '.join(rng.choices(vocabulary, weights, k=8)),) for _ in range(args.tasks)))
+    bot = await open_bot(api)
+    updates = Updates()
+    latencies = {'findtask': [], 'search_tasks': []}
+    found = 0
+    for i in range(args.commands):
+        words = rng.choices(vocabulary, weights, k=rng.randint(1, 2))
+        # Последнее слово иногда вводится не полностью
+        if rng.random() < 0.3:
+            words[-1] = words[-1][:3]
+        query = ' '.join(words)
+        started = time.perf_counter()
+        found += len(await bot.repo.search_tasks(query))
+        latencies['search_tasks'].append(time.perf_counter() - started)
+        latencies['findtask'].append(await process(bot, updates.message(1000 + i % 50, f"/findtask {query}")))
+    await close_bot(bot)
+    return {
+        'tasks': args.tasks,
+        'queries': args.commands,
+        'results_per_query': round(found / max(args.commands, 1), 1),
+        'latency': {name: percentiles(values) for name, values in latencies.items()},
+    }
+
+
+async def scenario_scheduler(api, args, workdir):
+    # Загрузка уведомлений в планировщик и точность срабатывания
+    await seed(workdir, chats=1000, notifications=args.rows)
+    bot = await open_bot(api)
+    started = time.perf_counter()
+    await bot.schedule_all_notifications()
+    hydration = time.perf_counter() - started
+    lateness = []
+
+    async def record(planned):
+        lateness.append(time.time() - planned)
+
+    runner = asyncio.get_running_loop().create_task(bot.scheduler.run())
+    first = time.time() + 0.5
+    for i in range(args.rows):
+        planned = first + args.window * i / args.rows
+        bot.scheduler.add_job(('bench', i), OnceTrigger(planned), record)
+    deadline = time.time() + args.window + 10
+    while len(lateness) < args.rows and time.time() < deadline:
+        await asyncio.sleep(0.1)
+    runner.cancel()
+    await close_bot(bot)
+    return {
+        'rows': args.rows,
+        'hydration_s': round(hydration, 3),
+        'jobs_fired': len(lateness),
+        'window_s': args.window,
+        'lateness': percentiles(lateness),
+    }
+
+
+async def scenario_cold_start(api, args, workdir):
+    # Время создания NotificationBot, запуска до приема команд и до полной загрузки уведомлений
+    await seed(workdir, chats=args.chats, tasks=1000, notifications=args.rows)
+    started = time.perf_counter()
+    bot = mybot.NotificationBot(TOKEN, mode='polling', api_url=api.url)
+    init = time.perf_counter() - started
+    await bot.start()
+    ready = time.perf_counter() - started
+    await bot.hydration
+    hydrated = time.perf_counter() - started
+    await bot.application.updater.stop()
+    await bot.application.stop()
+    await close_bot(bot)
+    return {
+        'rows': args.rows,
+        'init_s': round(init, 3),
+        'ready_s': round(ready, 3),
+        'hydrated_s': round(hydrated, 3),
+    }
+
+
+SCENARIOS = {
+    'commands': scenario_commands,
+    'broadcast': scenario_broadcast,
+    'concurrent': scenario_concurrent,
+    'search': scenario_search,
+    'scheduler': scenario_scheduler,
+    'cold_start': scenario_cold_start,
+}
+
+
+def compare(previous, current, path=''):
+    # Сравнение числовых метрик с предыдущим прогоном
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        name = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            compare(old or {}, value, name)
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (value - old) / old * 100
+            print(f"{name}: {old} -> {value} ({change:+.1f}%)")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def main(args):
+    api = FakeBotApiProcess(port=free_port(), latency=args.latency)
+    await api.start()
+    results = {}
+    cwd = os.getcwd()
+    try:
+        for name in args.scenarios.split(','):
+            with tempfile.TemporaryDirectory() as workdir:
+                os.chdir(workdir)
+                try:
+                    scenario = SCENARIOS[name]
+                    if name == 'commands':
+                        results[name] = await scenario(api, args)
+                    else:
+                        results[name] = await scenario(api, args, workdir)
+                finally:
+                    os.chdir(cwd)
+            print(f"{name}: {json.dumps(results[name], ensure_ascii=False)}")
+    finally:
+        await api.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк бота на локальной заглушке Bot API")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--commands', type=int, default=300, help="количество итераций сценария команд")
+    parser.add_argument('--chats', type=int, default=10000, help="количество чатов для рассылки")
+    parser.add_argument('--rows', type=int, default=50000, help="количество строк notifications")
+    parser.add_argument('--tasks', type=int, default=300000, help="количество задач для поиска")
+    parser.add_argument('--window', type=float, default=2.0, help="окно срабатывания задач планировщика, с")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="файл результатов предыдущего прогона")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'scenarios': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(json.load(file)['scenarios'], results)
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 сообщение в секунду в один чат
+GLOBAL_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+PER_CHAT_RATE = float(os.getenv('BROADCAST_PER_CHAT_RATE', '1'))
+CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+QUEUE_SIZE = int(os.getenv('BROADCAST_QUEUE_SIZE', '1000'))
+MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '5'))
+
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # Остановка выдачи токенов после RetryAfter от Telegram; True, если пауза начата, а не продлена
+        now = time.monotonic()
+        started = self.paused_until <= now
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        return started
+
+    async def acquire(self):
+        # Ожидание свободного токена
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    self.updated = time.monotonic()
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastResult:
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = []
+        self.blocked = []
+        # Ответы RetryAfter и причины неудачных отправок: вместо строки лога на каждый чат
+        self.retries = 0
+        self.errors = Counter()
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.pending = total
+        self.done = asyncio.Event()
+        if not total:
+            self.done.set()
+
+    def record(self, chat_id, outcome):
+        # Учет результата отправки в один чат
+        if outcome == SENT:
+            self.sent += 1
+        elif outcome == BLOCKED:
+            self.blocked.append(chat_id)
+        else:
+            self.failed.append(chat_id)
+        self.pending -= 1
+        if self.pending == 0:
+            self.elapsed = time.monotonic() - self.started
+            self.done.set()
+
+    def summary(self):
+        return f"отправлено {self.sent} из {self.total}, заблокировано {len(self.blocked)}, ошибок {len(self.failed)}"
+
+    def log_fields(self):
+        # Поля итоговой записи лога рассылки
+        return {
+            'total': self.total,
+            'sent': self.sent,
+            'blocked': len(self.blocked),
+            'failed': len(self.failed),
+            'retries': self.retries,
+            'errors': dict(self.errors),
+            'elapsed': round(self.elapsed, 3),
+        }
+
+
+class Broadcaster:
+    def __init__(self, bot, on_blocked=None, concurrency=CONCURRENCY, rate=GLOBAL_RATE,
+                 per_chat_rate=PER_CHAT_RATE, queue_size=QUEUE_SIZE, max_retries=MAX_RETRIES):
+        self.bot = bot
+        self.on_blocked = on_blocked
+        self.concurrency = concurrency
+        self.per_chat_interval = 1 / per_chat_rate
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.chat_ready_at = {}
+        self.workers = []
+
+    async def start(self):
+        # Запуск воркеров отправки
+        if self.workers:
+            return
+        loop = asyncio.get_running_loop()
+        self.workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        logger.info("Рассылка запущена: %s воркеров, %s сообщений/с", self.concurrency, self.bucket.rate)
+
+    async def stop(self):
+        # Остановка воркеров отправки
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def broadcast(self, chat_ids, messages):
+        # Рассылка одинаковых сообщений по списку чатов
+        return await self.deliver((chat_id, messages) for chat_id in chat_ids)
+
+    async def deliver(self, deliveries):
+        # Отправка сообщений по чатам через ограниченную очередь; deliveries - пары (chat_id, сообщения)
+        await self.start()
+        deliveries = list(deliveries)
+        result = BroadcastResult(len(deliveries))
+        for chat_id, messages in deliveries:
+            await self.queue.put((chat_id, messages, result))
+        await result.done.wait()
+        if result.blocked and self.on_blocked:
+            await self.on_blocked(result.blocked)
+        logger.info("Рассылка завершена за %.2f с: %s", result.elapsed, result.summary(), extra=result.log_fields())
+        return result
+
+    async def _worker(self):
+        while True:
+            chat_id, messages, result = await self.queue.get()
+            try:
+                outcome = await self._send_all(chat_id, messages, result)
+            except Exception as e:
+                # Трассировка пишется для первой ошибки каждого типа в рассылке, остальные только считаются
+                reason = type(e).__name__
+                if not result.errors[reason]:
+                    logger.exception("Ошибка отправки в чат %s", chat_id)
+                result.errors[reason] += 1
+                outcome = FAILED
+            finally:
+                self.queue.task_done()
+            result.record(chat_id, outcome)
+
+    async def _send_all(self, chat_id, messages, result):
+        # Последовательная отправка сообщений в один чат
+        for text in messages:
+            outcome = await self._send(chat_id, text, result)
+            if outcome != SENT:
+                return outcome
+        return SENT
+
+    async def _send(self, chat_id, text, result):
+        # Отправка одного сообщения с повторами; подробности по отдельным чатам пишутся только на уровне DEBUG
+        attempt = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return SENT
+            except RetryAfter as e:
+                # RetryAfter не расходует попытки: Telegram явно сообщает, когда можно продолжить
+                result.retries += 1
+                if self.bucket.pause(e.retry_after):
+                    logger.warning("Флуд-лимит Telegram, пауза %s с", e.retry_after)
+                logger.debug("RetryAfter при отправке в чат %s", chat_id)
+            except Forbidden:
+                logger.debug("Бот заблокирован или удален из чата %s", chat_id)
+                return BLOCKED
+            except BadRequest as e:
+                result.errors[e.message] += 1
+                logger.debug("Сообщение в чат %s отклонено: %s", chat_id, e)
+                return FAILED
+            except NetworkError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    result.errors[e.message] += 1
+                    logger.debug("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+                    return FAILED
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def _wait_for_chat(self, chat_id):
+        # Соблюдение лимита сообщений в один чат
+        now = time.monotonic()
+        ready_at = self.chat_ready_at.get(chat_id, 0.0)
+        self.chat_ready_at[chat_id] = max(now, ready_at) + self.per_chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        if len(self.chat_ready_at) > 10000:
+            self.chat_ready_at = {key: value for key, value in self.chat_ready_at.items() if value > now}
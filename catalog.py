@@ -0,0 +1,67 @@
+import logging
+import os
+import time
+from string import Template
+
+logger = logging.getLogger(__name__)
+
+# Каталог текстов поставляется вместе с кодом
+MESSAGES_DIR = os.getenv('MESSAGES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messages'))
+# Как часто проверяется время изменения файлов текстов
+MESSAGES_CHECK_INTERVAL = float(os.getenv('MESSAGES_CHECK_INTERVAL', '5'))
+
+
+class Entry:
+    __slots__ = ('path', 'text', 'template', 'mtime', 'checked_at')
+
+    def __init__(self, path):
+        self.path = path
+        self.text = None
+        self.template = None
+        self.mtime = None
+        self.checked_at = 0.0
+
+
+class MessageCatalog:
+    # Тексты ответов из файлов: хранятся в памяти и перечитываются только после изменения файла
+    def __init__(self, directory=MESSAGES_DIR, paths=None, defaults=None, check_interval=MESSAGES_CHECK_INTERVAL):
+        self.directory = directory
+        # Файлы вне каталога сообщений: имя -> путь
+        self.paths = paths or {}
+        # Значения подстановок по умолчанию для всех шаблонов
+        self.defaults = defaults or {}
+        self.check_interval = check_interval
+        self.entries = {}
+
+    def get(self, name):
+        # Текст без подстановок
+        return self._entry(name).text
+
+    def render(self, name, **values):
+        # Текст шаблона ($имя) с подстановкой значений
+        return self._entry(name).template.substitute(self.defaults, **values)
+
+    def _entry(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = self.entries[name] = Entry(self.paths.get(name) or os.path.join(self.directory, f"{name}.txt"))
+        now = time.monotonic()
+        if entry.text is not None and now - entry.checked_at < self.check_interval:
+            return entry
+        entry.checked_at = now
+        try:
+            mtime = os.stat(entry.path).st_mtime_ns
+        except FileNotFoundError:
+            if entry.text is None:
+                del self.entries[name]
+                raise
+            # Файл удален: используется последняя загруженная версия
+            logger.warning("Файл %s не найден, используется загруженный ранее текст", entry.path)
+            return entry
+        if mtime != entry.mtime:
+            with open(entry.path, encoding='utf-8') as file:
+                entry.text = file.read().rstrip('\n')
+            entry.template = Template(entry.text)
+            entry.mtime = mtime
+            logger.info("Текст %s загружен из %s", name, entry.path)
+        return entry
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+from telegram import Bot
+
+from broadcast import GLOBAL_RATE, BroadcastResult, Broadcaster
+from logs import setup_logging
+from metrics import InstrumentedRequest, observe_api_request
+from scheduler import job_name
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_MODE = os.getenv('CLUSTER_MODE', '0') == '1'
+NODE_ID = os.getenv('NODE_ID') or f"{socket.gethostname()}:{os.getpid()}"
+# Срок аренды лидерства и интервал ее продления
+LEASE_TTL = float(os.getenv('LEASE_TTL', '10'))
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', '3'))
+# Количество процессов рассылки; 1 - рассылка в текущем процессе
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', '1'))
+# Как долго хранятся отметки о выполненных запланированных задачах
+CLAIMS_RETENTION = 2 * 24 * 3600
+
+SCHEDULER_LEASE = 'scheduler'
+
+
+class Cluster:
+    def __init__(self, db, node_id=NODE_ID, ttl=LEASE_TTL, heartbeat=HEARTBEAT_INTERVAL, on_elected=None, on_demoted=None, on_heartbeat=None):
+        self.db = db
+        self.node_id = node_id
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_heartbeat = on_heartbeat
+        self.is_leader = False
+        self.valid_until = 0.0
+        self.last_prune = 0.0
+
+    async def try_acquire(self):
+        # Захват или продление аренды: удается, если аренда наша или срок чужой истек
+        now = time.time()
+        result = await self.db.execute('''
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        ''', (SCHEDULER_LEASE, self.node_id, now + self.ttl, now))
+        if result.rowcount:
+            self.valid_until = now + self.ttl
+        return result.rowcount > 0
+
+    async def release(self):
+        # Досрочное освобождение аренды при остановке, чтобы другой узел стал лидером сразу
+        if self.is_leader:
+            await self.db.execute('UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?', (SCHEDULER_LEASE, self.node_id))
+            await self._demote()
+
+    async def claim(self, job, planned_at):
+        # Отметка о выполнении запланированной задачи: гарантирует одну отправку даже при смене лидера
+        if not self.is_leader or time.time() > self.valid_until:
+            return False
+        job = job_name(job)
+        result = await self.db.execute(
+            'INSERT OR IGNORE INTO job_claims (job, planned_at, node) VALUES (?, ?, ?)',
+            (job, planned_at, self.node_id),
+        )
+        if not result.rowcount:
+            logger.info("Задача %s на %s уже выполнена другим узлом", job, planned_at)
+        return result.rowcount > 0
+
+    async def run(self):
+        # Цикл выборов: продление аренды, смена ролей и фоновые задачи лидера
+        while True:
+            try:
+                acquired = await self.try_acquire()
+            except Exception:
+                logger.exception("Не удалось продлить аренду лидерства")
+                acquired = False
+            if acquired and not self.is_leader:
+                self.is_leader = True
+                logger.info("Узел %s стал лидером", self.node_id)
+                if self.on_elected:
+                    await self.on_elected()
+            elif not acquired and self.is_leader:
+                # Аренду не удалось продлить: задачи лидера останавливаются до следующей попытки
+                await self._demote()
+            if self.is_leader:
+                await self._leader_heartbeat()
+            await asyncio.sleep(self.heartbeat)
+
+    async def _leader_heartbeat(self):
+        try:
+            if self.on_heartbeat:
+                await self.on_heartbeat()
+            if time.time() - self.last_prune > 3600:
+                self.last_prune = time.time()
+                await self.db.execute('DELETE FROM job_claims WHERE planned_at < ?', (time.time() - CLAIMS_RETENTION,))
+        except Exception:
+            logger.exception("Ошибка фоновой задачи лидера")
+
+    async def _demote(self):
+        self.is_leader = False
+        logger.info("Узел %s больше не лидер", self.node_id)
+        if self.on_demoted:
+            await self.on_demoted()
+
+
+def shard_of(chat_id, shards):
+    # Номер процесса рассылки для чата
+    return hash(chat_id) % shards
+
+
+class ShardWorker:
+    # Состояние процесса рассылки: event loop, Bot и Broadcaster создаются один раз на процесс,
+    # поэтому соединения с Bot API, пауза после RetryAfter и интервалы отправки по чатам сохраняются между рассылками
+    def __init__(self, token, api_url, rate):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.request = InstrumentedRequest(connection_pool_size=256, calls=[])
+        self.bot = Bot(token, base_url=f"{api_url}/bot", request=self.request)
+        self.broadcaster = Broadcaster(self.bot, rate=rate)
+
+    def deliver(self, deliveries):
+        # Запросы к Bot API возвращаются вместе с результатом, чтобы родитель учел их в своих метриках
+        result = self.loop.run_until_complete(self._deliver(deliveries))
+        calls, self.request.calls = self.request.calls, []
+        return result.sent, result.blocked, result.failed, result.retries, result.errors, calls
+
+    async def _deliver(self, deliveries):
+        # Bot инициализируется при первой рассылке, а не в инициализаторе процесса:
+        # ошибка инициализатора ломает пул, а ошибка здесь затрагивает только одну рассылку
+        await self.bot.initialize()
+        return await self.broadcaster.deliver(deliveries)
+
+    def close(self):
+        self.loop.run_until_complete(self.broadcaster.stop())
+        self.loop.run_until_complete(self.bot.shutdown())
+        self.loop.close()
+
+
+_shard_worker = None
+
+
+def init_shard_worker(token, api_url, rate):
+    # Инициализатор процесса рассылки. У процесса свой поток записи логов: поток родителя в дочерний процесс не переходит
+    global _shard_worker
+    setup_logging()
+    _shard_worker = ShardWorker(token, api_url, rate)
+    # atexit в процессах multiprocessing не вызывается, поэтому закрытие регистрируется через Finalize
+    Finalize(_shard_worker, _shard_worker.close, exitpriority=10)
+
+
+def deliver_shard(deliveries):
+    # Рассылка одной доли чатов в процессе рассылки
+    return _shard_worker.deliver(deliveries)
+
+
+class ShardedFanout:
+    # Рассылка, разделенная между процессами по хешу chat_id; интерфейс совпадает с Broadcaster
+    def __init__(self, token, api_url, on_blocked=None, workers=FANOUT_WORKERS, rate=GLOBAL_RATE):
+        self.token = token
+        self.api_url = api_url
+        self.on_blocked = on_blocked
+        self.workers = workers
+        self.rate = rate
+        self.pools = []
+
+    async def start(self):
+        if not self.pools:
+            # По процессу на долю: чаты доли всегда попадают в один и тот же процесс и его Broadcaster.
+            # Общий лимит Telegram делится между процессами поровну
+            rate = self.rate / self.workers
+            self.pools = [
+                ProcessPoolExecutor(max_workers=1, initializer=init_shard_worker, initargs=(self.token, self.api_url, rate))
+                for _ in range(self.workers)
+            ]
+            logger.info("Рассылка распределена на %s процессов", self.workers)
+
+    async def stop(self):
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+        self.pools = []
+
+    async def broadcast(self, chat_ids, messages):
+        return await self.deliver((chat_id, messages) for chat_id in chat_ids)
+
+    async def deliver(self, deliveries):
+        await self.start()
+        shards = [[] for _ in range(self.workers)]
+        for chat_id, messages in deliveries:
+            shards[shard_of(chat_id, self.workers)].append((chat_id, messages))
+        result = BroadcastResult(sum(len(shard) for shard in shards))
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(*(
+            loop.run_in_executor(pool, deliver_shard, shard)
+            for pool, shard in zip(self.pools, shards) if shard
+        ))
+        for sent, blocked, failed, retries, errors, calls in outcomes:
+            result.sent += sent
+            result.blocked.extend(blocked)
+            result.failed.extend(failed)
+            result.retries += retries
+            result.errors.update(errors)
+            for call in calls:
+                observe_api_request(*call)
+        result.elapsed = time.monotonic() - result.started
+        if result.blocked and self.on_blocked:
+            await self.on_blocked(result.blocked)
+        logger.info("Распределенная рассылка завершена за %.2f с: %s", result.elapsed, result.summary(), extra=result.log_fields())
+        return result
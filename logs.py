@@ -0,0 +1,75 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Формат логов: json - одна JSON-запись на строку, text - человекочитаемые строки
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Чат и команда обрабатываемого обновления: добавляются ко всем записям, сделанным при его обработке
+CHAT_ID = contextvars.ContextVar('chat_id', default=None)
+COMMAND = contextvars.ContextVar('command', default=None)
+
+# Стандартные атрибуты LogRecord; остальные атрибуты записи - поля, переданные через extra
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class ContextFilter(logging.Filter):
+    # Добавление chat_id и command из контекста обработчика; явно переданные в extra значения не перезаписываются
+    def filter(self, record):
+        if getattr(record, 'chat_id', None) is None:
+            record.chat_id = CHAT_ID.get()
+        if getattr(record, 'command', None) is None:
+            record.command = COMMAND.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # Запись лога в виде одной строки JSON
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    # В отличие от QueueHandler, запись не форматируется в вызывающем потоке: подстановка аргументов
+    # и форматирование выполняются в потоке QueueListener. Аргументы записи не должны меняться после вызова логгера
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    # Логи пишутся из фонового потока: event loop только кладет запись в очередь.
+    # Возвращает QueueListener, который нужно остановить при завершении, чтобы дописать очередь
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx пишет строку на каждый запрос к Bot API: при рассылке это по строке на чат
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,144 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from telegram.request import HTTPXRequest
+
+from logs import CHAT_ID, COMMAND
+
+logger = logging.getLogger(__name__)
+
+# Локальный адрес метрик; пустой порт отключает сервер метрик
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = os.getenv('METRICS_PORT', '9090')
+EVENT_LOOP_INTERVAL = 0.5
+
+HANDLER_LATENCY = Histogram('bot_handler_seconds', 'Время обработки команд', ['command'])
+DB_QUERY_LATENCY = Histogram(
+    'bot_db_query_seconds', 'Время выполнения запросов SQLite', ['database', 'query'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+API_REQUESTS = Counter('bot_api_requests_total', 'Запросы к Bot API', ['method', 'code'])
+API_LATENCY = Histogram('bot_api_request_seconds', 'Время запросов к Bot API', ['method'])
+SCHEDULER_LATENESS = Histogram(
+    'bot_scheduler_lateness_seconds', 'Опоздание срабатывания запланированных задач', ['job'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0),
+)
+SCHEDULER_CATCHUP = Counter('bot_scheduler_catchup_total', 'Пропущенные срабатывания, досланные после запуска', ['job'])
+OUTBOX_MESSAGES = Counter('bot_outbox_messages_total', 'Обработанные сообщения очереди отправки', ['status'])
+EVENT_LOOP_LAG = Histogram(
+    'bot_event_loop_lag_seconds', 'Задержка event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+def timed_handler(command, callback):
+    # Обертка обработчика с замером времени; результат (например, состояние диалога) сохраняется.
+    # Записи лога, сделанные при обработке, получают поля command и chat_id
+    histogram = HANDLER_LATENCY.labels(command)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        chat = getattr(update, 'effective_chat', None)
+        command_token = COMMAND.set(command)
+        chat_token = CHAT_ID.set(chat.id if chat else None)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            CHAT_ID.reset(chat_token)
+            COMMAND.reset(command_token)
+
+    return wrapper
+
+
+def query_label(sql):
+    # Метка запроса: первые слова SQL без лишних пробелов. Подходит только для запросов с постоянным текстом,
+    # иначе каждый вариант текста создает отдельную серию метрики
+    return " ".join(sql.split())[:80]
+
+
+def observe_api_request(api_method, code, seconds):
+    # Учет одного запроса к Bot API
+    API_REQUESTS.labels(api_method, code).inc()
+    API_LATENCY.labels(api_method).observe(seconds)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    # HTTP-клиент Bot API с подсчетом запросов, кодов ответа и времени.
+    # Если задан список calls, запросы не пишутся в метрики процесса, а копятся в нем как (метод, код, время):
+    # так процесс рассылки передает их родителю, который отдает метрики
+    def __init__(self, *args, calls=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = calls
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+        except Exception:
+            self.record(api_method, 'network_error', time.perf_counter() - started)
+            raise
+        self.record(api_method, str(code), time.perf_counter() - started)
+        return code, payload
+
+    def record(self, api_method, code, seconds):
+        if self.calls is None:
+            observe_api_request(api_method, code, seconds)
+        else:
+            self.calls.append((api_method, code, seconds))
+
+
+async def monitor_event_loop(interval=EVENT_LOOP_INTERVAL):
+    # Замер задержки event loop: насколько позже запланированного просыпается короткий sleep
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+class MetricsServer:
+    def __init__(self, listen=METRICS_LISTEN, port=METRICS_PORT):
+        self.listen = listen
+        self.port = int(port) if port else None
+        self.runner = None
+        self.monitor = None
+
+    async def start(self):
+        # Запуск HTTP-сервера метрик в формате Prometheus и замера задержки event loop
+        self.monitor = asyncio.get_running_loop().create_task(monitor_event_loop())
+        if self.port is None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.listen, self.port).start()
+        except OSError as e:
+            # Занятый порт не должен мешать запуску бота: он работает дальше без /metrics
+            logger.error("Не удалось запустить сервер метрик на %s:%s: %s", self.listen, self.port, e)
+            await self.runner.cleanup()
+            self.runner = None
+            return
+        logger.info("Метрики доступны по адресу http://%s:%s/metrics", self.listen, self.port)
+
+    async def stop(self):
+        if self.monitor is not None:
+            self.monitor.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
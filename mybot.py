@@ -1,74 +1,150 @@
 import sys
 sys.path.append('/path/to/your/module')
 
-import schedule
+import csv
+import tempfile
 import time
 from datetime import datetime
-from telegram import Bot, Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackContext, ConversationHandler
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, filters, CallbackContext, ConversationHandler
 import asyncio
 import logging
-import sqlite3
 import pytz  # Добавлено для работы с часовыми поясами
 from dotenv import load_dotenv
 import os
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Переменные из .env нужны до импорта модулей, которые читают настройки при загрузке
+load_dotenv()
+
+from broadcast import Broadcaster
+from catalog import MessageCatalog
+from cluster import CLUSTER_MODE, FANOUT_WORKERS, Cluster, ShardedFanout
+from logs import setup_logging
+from metrics import InstrumentedRequest, MetricsServer, timed_handler
+from outbox import CATCHUP_WINDOW, Outbox
+from persistence import SQLitePersistence
+from scheduler import DEFAULT_TIMEZONE, DailyTrigger, TimerScheduler, daily_window, job_name
+from storage import Repository, fts_query
+from task_list import PAGE_SIZE, TaskListCache, parse_tasks, preview, render_search_results, render_task_page, write_tasks_csv
+from update_processor import BoundedUpdateQueue, ChatOrderedUpdateProcessor
+from webhook import WEBHOOK_QUEUE_SIZE, WEBHOOK_SECRET, WEBHOOK_URL, WebhookServer
+
 logger = logging.getLogger(__name__)
 
 # Определение состояний для ConversationHandlerç
 ADDING_TASK = 1
 ADDING_REGRESS_PRODUCT = 2
+IMPORTING_TASKS = 3
+
+# Bot API отдает боту файлы размером не более 20 МБ и принимает от него документы не более 50 МБ
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+MAX_EXPORT_SIZE = 50 * 1024 * 1024
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Адрес Bot API; переопределяется для локального запуска без Telegram
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+# Уведомления, срабатывающие в ближайшие HYDRATION_HORIZON секунд, загружаются при запуске первыми
+HYDRATION_HORIZON = int(os.getenv('HYDRATION_HORIZON', '3600'))
+# Табличка, которую заполняет регрессный продакт
+TABLE_URL = os.getenv('TABLE_URL', 'https://docs.google.com/spreadsheets/d/18kJ5GEui0bA0GiGiwe_ZUQd2l7-iwVe4QUCzvJLfmac/edit?usp=sharing')
 
 class NotificationBot:
-    def __init__(self, token):
-        self.application = ApplicationBuilder().token(token).build()
-        self.conn_tasks = sqlite3.connect('tasks.db')
-        self.conn_notifications = sqlite3.connect('notifications.db')
-        self.create_tables()
-        
-        # Установка команд
-        self.set_commands()
+    def __init__(self, token, mode=BOT_MODE, api_url=TELEGRAM_API_URL):
+        self.mode = mode
+        if CLUSTER_MODE and mode != 'webhook':
+            # Несколько процессов с getUpdates конфликтуют между собой
+            raise ValueError("Режим кластера поддерживается только с BOT_MODE=webhook")
+        if mode == 'webhook' and not WEBHOOK_SECRET:
+            # Без секрета любой, кто может достучаться до порта вебхука, мог бы присылать поддельные команды
+            raise ValueError("Для BOT_MODE=webhook необходимо задать WEBHOOK_SECRET")
+        # Состояние диалогов переживает перезапуск бота
+        self.persistence = SQLitePersistence()
+        # Ограниченная очередь входящих обновлений: общая для polling и вебхука.
+        # Очередь выдает обновления в обработку, только пока в работе меньше лимита обработчика
+        processor = ChatOrderedUpdateProcessor()
+        self.application = (
+            ApplicationBuilder()
+            .token(token)
+            .base_url(f"{api_url}/bot")
+            .base_file_url(f"{api_url}/file/bot")
+            .request(InstrumentedRequest(connection_pool_size=256))
+            .update_queue(BoundedUpdateQueue(processor, maxsize=WEBHOOK_QUEUE_SIZE))
+            .persistence(self.persistence)
+            .concurrent_updates(processor)
+            .build()
+        )
+        self.webhook = WebhookServer(self.application) if mode == 'webhook' else None
+        self.repo = Repository('tasks.db', 'notifications.db')
+        self.repo.create_tables(change_log=CLUSTER_MODE)
+        self.task_list = TaskListCache(self.repo)
+        if FANOUT_WORKERS > 1:
+            self.broadcaster = ShardedFanout(token, api_url, on_blocked=self.repo.prune_chats)
+        else:
+            self.broadcaster = Broadcaster(self.application.bot, on_blocked=self.repo.prune_chats)
+        # В режиме кластера запланированные задачи выполняет только лидер
+        self.cluster = None
+        if CLUSTER_MODE:
+            self.cluster = Cluster(
+                self.repo.notifications_db,
+                on_elected=self.become_leader,
+                on_demoted=self.step_down,
+                on_heartbeat=self.sync_notifications,
+            )
+            self.repo.shared = True
+        self.scheduler = TimerScheduler(guard=self.cluster.claim if self.cluster else None)
+        # Запланированные рассылки проходят через очередь в базе и переживают перезапуск
+        self.outbox = Outbox(self.repo.notifications_db, self.broadcaster)
+        # Номер последнего примененного изменения уведомлений
+        self.changes_seq = 0
+        # Уведомления, сгруппированные по времени срабатывания: (время, пояс) -> {номер: chat_id}
+        self.slots = {}
+        self.notification_slots = {}
+        # Фоновая загрузка уведомлений из базы
+        self.hydration = None
+        self.metrics = MetricsServer()
+        self.messages = MessageCatalog(paths={'useful_links': 'useful_links.txt'}, defaults={'table_url': TABLE_URL})
 
         # Добавление обработчиков команд
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("notify", self.notify_command))
-        self.application.add_handler(CommandHandler("listtasks", self.list_tasks_command))
-        self.application.add_handler(CommandHandler("closetask", self.close_task_command))
-        self.application.add_handler(CommandHandler("setnotification", self.set_notification_command))
-        self.application.add_handler(CommandHandler("listnotifications", self.list_notifications_command))
-        self.application.add_handler(CommandHandler("deletenotification", self.delete_notification_command))
-        self.application.add_handler(CommandHandler("useful_links", self.useful_links_command))
-        self.application.add_handler(CommandHandler("setregressproduct", self.set_regress_product_command))
-        self.application.add_handler(CommandHandler("currentregressproduct", self.current_regress_product_command))
-        self.application.add_handler(CommandHandler("remind_fill_table", self.remind_fill_table_command))
-        self.application.add_handler(CommandHandler("onboarding", self.onboarding_command))
+        self.application.add_handler(CommandHandler("start", timed_handler("start", self.start_command)))
+        self.application.add_handler(CommandHandler("help", timed_handler("help", self.help_command)))
+        self.application.add_handler(CommandHandler("notify", timed_handler("notify", self.notify_command)))
+        self.application.add_handler(CommandHandler("listtasks", timed_handler("listtasks", self.list_tasks_command)))
+        self.application.add_handler(CommandHandler("closetask", timed_handler("closetask", self.close_task_command)))
+        self.application.add_handler(CommandHandler("findtask", timed_handler("findtask", self.find_task_command)))
+        self.application.add_handler(CommandHandler("setnotification", timed_handler("setnotification", self.set_notification_command)))
+        self.application.add_handler(CommandHandler("listnotifications", timed_handler("listnotifications", self.list_notifications_command)))
+        self.application.add_handler(CommandHandler("deletenotification", timed_handler("deletenotification", self.delete_notification_command)))
+        self.application.add_handler(CommandHandler("useful_links", timed_handler("useful_links", self.useful_links_command)))
+        self.application.add_handler(CommandHandler("setregressproduct", timed_handler("setregressproduct", self.set_regress_product_command)))
+        self.application.add_handler(CommandHandler("currentregressproduct", timed_handler("currentregressproduct", self.current_regress_product_command)))
+        self.application.add_handler(CommandHandler("remind_fill_table", timed_handler("remind_fill_table", self.remind_fill_table_command)))
+        self.application.add_handler(CommandHandler("onboarding", timed_handler("onboarding", self.onboarding_command)))
+        self.application.add_handler(CommandHandler("exporttasks", timed_handler("exporttasks", self.export_tasks_command)))
+        self.application.add_handler(CallbackQueryHandler(timed_handler('page_callback', self.page_callback), pattern=r'^(tasks|notifications):(next|prev):\d+$'))
         
         # Добавление ConversationHandler для добавления задач
         conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('addtask', self.add_task_command)],
+            entry_points=[
+                CommandHandler('addtask', timed_handler('addtask', self.add_task_command)),
+                CommandHandler('importtasks', timed_handler('importtasks', self.import_tasks_command)),
+            ],
             states={
-                ADDING_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.save_task)],
-                ADDING_REGRESS_PRODUCT: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.save_regress_product)]
+                ADDING_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler('save_task', self.save_task))],
+                ADDING_REGRESS_PRODUCT: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler('save_regress_product', self.save_regress_product))],
+                IMPORTING_TASKS: [MessageHandler(filters.Document.ALL, timed_handler('save_imported_tasks', self.save_imported_tasks))],
             },
-            fallbacks=[CommandHandler('cancel', self.cancel_command)]
+            fallbacks=[CommandHandler('cancel', timed_handler('cancel', self.cancel_command))],
+            name='addtask',
+            persistent=True,
         )
         self.application.add_handler(conv_handler)
         
-        # Планирование всех уведомлений из базы данных
-        self.schedule_all_notifications()
-        
-        # Планирование уведомлений о регрессном продакте
-        self.schedule_regress_product_notification()
-        
         logger.info("Бот инициализирован")
 
-    def set_commands(self):
+    async def set_commands(self):
         # Установка команд для отображения в интерфейсе Telegram
         commands = [
             ("start", "Запустить бота"),
@@ -76,191 +152,266 @@ class NotificationBot:
             ("notify", "Отправить уведомление во все чаты"),
             ("listtasks", "Список задач в общем списке"),
             ("closetask", "Закрыть задачу по номеру"),
+            ("findtask", "Найти задачу по словам"),
             ("setnotification", "Установить уведомление на определенное время"),
             ("listnotifications", "Список всех уведомлений"),
             ("deletenotification", "Удалить уведомление по номеру"),
             ("addtask", "Добавить задачу в общий список"),
+            ("importtasks", "Загрузить задачи из файла"),
+            ("exporttasks", "Выгрузить задачи в файл"),
             ("cancel", "Отменить добавление задачи"),
             ("useful_links", "Полезные ссылки"),
             ("setregressproduct", "Установить регрессного продакта"),
             ("currentregressproduct", "Текущий регрессный продакт"),
             ("onboarding", "Информация для новых пользователей")  # Добавлено
         ]
-        self.application.bot.set_my_commands(commands)
+        await self.application.bot.set_my_commands(commands)
         logger.info("Команды установлены")
 
-    def create_tables(self):
-        # Создание таблиц задач и чатов, если они не существуют
-        with self.conn_tasks:
-            self.conn_tasks.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task TEXT NOT NULL
-                )
-            ''')
-            self.conn_tasks.execute('''
-                CREATE TABLE IF NOT EXISTS chats (
-                    id INTEGER PRIMARY KEY
-                )
-            ''')
-        with self.conn_notifications:
-            self.conn_notifications.execute('''
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER NOT NULL,
-                    time TEXT NOT NULL
-                )
-            ''')
-            self.conn_notifications.execute('''
-                CREATE TABLE IF NOT EXISTS regress_product (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL
-                )
-            ''')
-        logger.info("Таблицы созданы или уже существуют")
-
     async def start_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /start
         chat_id = update.effective_chat.id
-        self.add_chat(chat_id)
+        await self.repo.add_chat(chat_id)
         await update.message.reply_text("Привет! Я бот для уведомлений. Используйте /help для получения списка команд и /onboarding для ознакомления с ботом.")
-        logger.info(f"Команда /start выполнена в чате {chat_id}")
+        logger.info("Команда /start выполнена в чате %s", chat_id)
 
     async def help_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /help
-        await update.message.reply_text(
-            "Доступные команды:\n"
-            "/start - Приветствие\n"
-            "/help - Список команд\n"
-            "/notify - Отправить уведомления во все чаты\n"
-            "/addtask - Добавить задачу в общий список\n"
-            "/listtasks - Показать список задач в общем списке\n"
-            "/closetask <номер> - Закрыть задачу по номеру\n"
-            "/setnotification <время> - Установить уведомление на определенное время\n"
-            "/listnotifications - Показать список всех уведомлений\n"
-            "/deletenotification <номер> - Удалить уведомление по номеру\n"
-            "/useful_links - Полезные ссылки\n"
-            "/setregressproduct <@продакт> - Установить регрессного продакта\n"
-            "/currentregressproduct - Текущий регрессный продакт\n"
-            "/onboarding - Информация для новых пользователей"
-        )
+        await update.message.reply_text(self.messages.get('help'))
         logger.info("Команда /help выполнена")
 
     async def notify_command(self, update: Update, context: CallbackContext):
-        # Обработчик команды /notify
-        chat_ids = self.get_chat_ids()
-        for chat_id in chat_ids:
-            await self.send_task_list(chat_id)
-        await update.message.reply_text("Список задач отправлен во все чаты.")
+        # Обработчик команды /notify: рассылка идет в фоне, по завершении отправляется отчет
+        chat_ids = await self.repo.get_chat_ids()
+        await update.message.reply_text(f"Рассылка списка задач запущена: {len(chat_ids)} чатов.")
+        context.application.create_task(self.notify_all(update, chat_ids), update=update)
         logger.info("Команда /notify выполнена")
 
+    async def notify_all(self, update, chat_ids):
+        # Фоновая рассылка списка задач во все чаты
+        result = await self.broadcaster.broadcast(chat_ids, await self.task_list.get())
+        await update.message.reply_text(f"Список задач отправлен во все чаты: {result.summary()}.")
+
     async def set_notification_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /setnotification
-        if len(context.args) != 1:
-            await update.message.reply_text("Пожалуйста, введите время для уведомлений в формате ЧЧ:ММ. Пример: /setnotification 13:10")
+        if len(context.args) not in (1, 2):
+            await update.message.reply_text("Пожалуйста, введите время для уведомлений в формате ЧЧ:ММ и, при необходимости, часовой пояс. Пример: /setnotification 13:10 Europe/Moscow")
             return
 
         notification_time = context.args[0]
+        notification_tz = context.args[1] if len(context.args) == 2 else DEFAULT_TIMEZONE
         chat_id = update.effective_chat.id
 
         # Проверка формата времени
         try:
-            datetime.strptime(notification_time, "%H:%M")
+            notification_time = datetime.strptime(notification_time, "%H:%M").strftime("%H:%M")
         except ValueError:
             await update.message.reply_text("Неверный формат времени. Пожалуйста, введите время в формате ЧЧ:ММ.")
             return
 
-        self.add_notification(chat_id, notification_time)
-        self.schedule_notification(chat_id, notification_time)
-        await update.message.reply_text(f"Уведомления настроены на {notification_time}.")
-        logger.info(f"Уведомления для чата {chat_id} настроены на {notification_time}")
+        # Проверка часового пояса; сохраняется каноническое имя, поиск в pytz не учитывает регистр
+        try:
+            notification_tz = pytz.timezone(notification_tz).zone
+        except pytz.UnknownTimeZoneError:
+            await update.message.reply_text("Неизвестный часовой пояс. Пожалуйста, укажите его в формате IANA, например Europe/Moscow.")
+            return
+
+        notification_id = await self.repo.add_notification(chat_id, notification_time, notification_tz)
+        if notification_id is None:
+            await update.message.reply_text(f"Уведомление на {notification_time} ({notification_tz}) уже настроено.")
+            return
+        if self.schedules_locally():
+            self.schedule_notification(notification_id, chat_id, notification_time, notification_tz)
+        await update.message.reply_text(f"Уведомления настроены на {notification_time} ({notification_tz}).")
+        logger.info("Уведомления для чата %s настроены на %s (%s)", chat_id, notification_time, notification_tz)
 
         # Отправка списка всех уведомлений
         await self.list_notifications_command(update, context)
 
     async def list_notifications_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /listnotifications
-        notifications = self.get_notifications()
-        if notifications:
-            notifications_list = "\n".join(f"{i+1}. Чат {chat_id}: {time}" for i, (chat_id, time) in enumerate(notifications))
-            await update.message.reply_text(f"Текущие уведомления:\n{notifications_list}")
-        else:
-            await update.message.reply_text("Список уведомлений пуст.")
+        text, reply_markup = await self.notifications_page()
+        await update.message.reply_text(text, reply_markup=reply_markup)
         logger.info("Команда /listnotifications выполнена")
 
+    async def notifications_page(self, after_id=0, before_id=None):
+        # Формирование страницы списка уведомлений
+        page = await self.repo.get_notifications_page(after_id, before_id, PAGE_SIZE)
+        if not page.rows and (after_id or before_id is not None):
+            page = await self.repo.get_notifications_page(limit=PAGE_SIZE)
+        if not page.rows:
+            return "Список уведомлений пуст.", None
+        notifications_list = "\n".join(f"{notification_id}. Чат {chat_id}: {time} ({preview(tz)})" for notification_id, chat_id, time, tz in page.rows)
+        return f"Текущие уведомления:\n{notifications_list}", self.page_keyboard('notifications', page)
+
+    def page_keyboard(self, prefix, page):
+        # Кнопки перехода между страницами списка
+        buttons = []
+        if page.has_prev:
+            buttons.append(InlineKeyboardButton("« Назад", callback_data=f"{prefix}:prev:{page.rows[0][0]}"))
+        if page.has_next:
+            buttons.append(InlineKeyboardButton("Вперед »", callback_data=f"{prefix}:next:{page.rows[-1][0]}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def page_callback(self, update: Update, context: CallbackContext):
+        # Обработчик кнопок перехода между страницами: сообщение редактируется на месте
+        query = update.callback_query
+        prefix, direction, key = query.data.split(':')
+        after_id, before_id = (int(key), None) if direction == 'next' else (0, int(key))
+        if prefix == 'tasks':
+            text, reply_markup = await self.tasks_page(after_id, before_id)
+        else:
+            text, reply_markup = await self.notifications_page(after_id, before_id)
+        await query.answer()
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            # Telegram отклоняет редактирование, если содержимое не изменилось
+            if 'not modified' not in str(e):
+                raise
+        logger.info("Страница списка %s обновлена", prefix)
+
     async def delete_notification_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /deletenotification
         try:
-            notification_number = int(context.args[0]) - 1
-            if self.delete_notification(notification_number):
-                await update.message.reply_text(f"Уведомление номер {notification_number + 1} удалено.")
-                logger.info(f"Уведомление номер {notification_number + 1} удалено")
+            notification_id = int(context.args[0])
+            if await self.delete_notification(notification_id):
+                await update.message.reply_text(f"Уведомление номер {notification_id} удалено.")
+                logger.info("Уведомление номер %s удалено", notification_id)
             else:
-                await update.message.reply_text(f"Уведомление номер {notification_number + 1} не найдено.")
-                logger.info(f"Уведомление номер {notification_number + 1} не найдено")
+                await update.message.reply_text(f"Уведомление номер {notification_id} не найдено.")
+                logger.info("Уведомление номер %s не найдено", notification_id)
         except (IndexError, ValueError):
             await update.message.reply_text("Пожалуйста, укажите корректный номер уведомления.")
             logger.info("Некорректный номер уведомления для команды /deletenotification")
 
-    def add_chat(self, chat_id):
-        # Добавление чата в базу данных
-        with self.conn_tasks:
-            self.conn_tasks.execute('INSERT OR IGNORE INTO chats (id) VALUES (?)', (chat_id,))
-        logger.info(f"Чат {chat_id} добавлен в базу данных")
-
-    def get_chat_ids(self):
-        # Получение всех идентификаторов чатов из базы данных
-        with self.conn_tasks:
-            cursor = self.conn_tasks.execute('SELECT id FROM chats')
-            chat_ids = [row[0] for row in cursor.fetchall()]
-        return chat_ids
-
-    def add_notification(self, chat_id, time):
-        # Добавление уведомления в базу данных
-        with self.conn_notifications:
-            self.conn_notifications.execute('INSERT INTO notifications (chat_id, time) VALUES (?, ?)', (chat_id, time))
-        logger.info(f"Уведомление для чата {chat_id} добавлено на {time}")
-
-    def get_notifications(self):
-        # Получение всех уведомлений из базы данных
-        with self.conn_notifications:
-            cursor = self.conn_notifications.execute('SELECT chat_id, time FROM notifications')
-            notifications = cursor.fetchall()
-        return notifications
-
-    def delete_notification(self, notification_number):
-        # Удаление уведомления по номеру
-        notifications = self.get_notifications()
-        if 0 <= notification_number < len(notifications):
-            notification_to_delete = notifications[notification_number]
-            with self.conn_notifications:
-                self.conn_notifications.execute('DELETE FROM notifications WHERE chat_id = ? AND time = ?', notification_to_delete)
-            logger.info(f"Уведомление для чата {notification_to_delete[0]} на {notification_to_delete[1]} удалено из базы данных")
-            return True
-        return False
-
-    def schedule_notification(self, chat_id, time):
+    async def delete_notification(self, notification_id):
+        # Удаление уведомления по номеру и отмена его задачи в планировщике
+        if not await self.repo.delete_notification(notification_id):
+            return False
+        if self.schedules_locally():
+            self.unschedule_notification(notification_id)
+        return True
+
+    def schedules_locally(self):
+        # Изменения на других узлах кластера лидер получает из журнала изменений
+        return self.cluster is None or self.cluster.is_leader
+
+    def schedule_notification(self, notification_id, chat_id, time, tz=DEFAULT_TIMEZONE):
         # Планирование уведомления
-        schedule.every().day.at(time).do(self.schedule_notify, chat_id=chat_id)
-        logger.info(f"Уведомление для чата {chat_id} запланровано на {time}")
+        self.add_to_slot(notification_id, chat_id, time, tz)
+        logger.info("Уведомление для чата %s запланировано на %s (%s)", chat_id, time, tz)
+
+    def add_to_slot(self, notification_id, chat_id, time, tz):
+        # Добавление уведомления в группу; одна задача планировщика на каждое время срабатывания
+        self.unschedule_notification(notification_id)
+        slot = self.slots.get((time, tz))
+        if slot is None:
+            slot = self.slots[(time, tz)] = {}
+            self.scheduler.add_job(('notification_slot', time, tz), DailyTrigger(time, tz), self.notify_slot, time, tz)
+        slot[notification_id] = chat_id
+        self.notification_slots[notification_id] = (time, tz)
+
+    def unschedule_notification(self, notification_id):
+        # Удаление уведомления из группы; пустая группа снимается с планировщика
+        key = self.notification_slots.pop(notification_id, None)
+        if key is None:
+            return
+        slot = self.slots[key]
+        del slot[notification_id]
+        if not slot:
+            del self.slots[key]
+            self.scheduler.cancel_job(('notification_slot',) + key)
+
+    async def schedule_all_notifications(self):
+        # Потоковая загрузка уведомлений порциями: сначала ближайшие по времени, затем остальные
+        started = time.monotonic()
+        # Изменения после этого номера применит sync_notifications
+        self.changes_seq = await self.repo.get_notification_changes_seq()
+        due = 0
+        for tz in await self.repo.get_notification_timezones():
+            window = daily_window(tz, time.time(), HYDRATION_HORIZON)
+            if window is None:
+                break
+            async for rows in self.repo.iter_notifications(tz, window):
+                for notification_id, chat_id, at, row_tz in rows:
+                    self.add_to_slot(notification_id, chat_id, at, row_tz)
+                due += len(rows)
+        logger.info("Ближайшие уведомления запланированы: %s за %.2f с", due, time.monotonic() - started)
+        async for rows in self.repo.iter_notifications():
+            for notification_id, chat_id, at, tz in rows:
+                if notification_id not in self.notification_slots:
+                    self.add_to_slot(notification_id, chat_id, at, tz)
+        await self.repo.prune_notification_changes(self.changes_seq)
+        logger.info("Все уведомления запланированы: %s за %.2f с", len(self.notification_slots), time.monotonic() - started)
+
+    async def hydrate(self):
+        # Загрузка уведомлений и досылка срабатываний, пропущенных, пока бот был остановлен.
+        # Отметки читаются до загрузки: срабатывания во время загрузки тоже будут досланы
+        checkpoints = await self.outbox.get_checkpoints()
+        last_alive = await self.outbox.get_last_alive()
+        await self.schedule_all_notifications()
+        missed = self.scheduler.catch_up(checkpoints, CATCHUP_WINDOW, last_alive=last_alive)
+        if missed:
+            logger.info("Пропущенных срабатываний поставлено в очередь: %s", missed)
+
+    def start_hydration(self):
+        # Загрузка уведомлений в фоне, не задерживая прием команд
+        self.hydration = asyncio.get_running_loop().create_task(self.hydrate())
+        self.hydration.add_done_callback(self.hydration_done)
+
+    def hydration_done(self, task):
+        if not task.cancelled() and task.exception():
+            logger.error("Ошибка при загрузке уведомлений", exc_info=task.exception())
+
+    def stop_hydration(self):
+        if self.hydration is not None:
+            self.hydration.cancel()
+            self.hydration = None
+
+    async def sync_notifications(self):
+        # Применение изменений уведомлений, сделанных на других узлах кластера
+        changes = await self.repo.get_notification_changes(self.changes_seq)
+        if not changes:
+            return
+        for seq, op, notification_id, chat_id, time, tz in changes:
+            if op == 'insert' and chat_id is not None:
+                self.schedule_notification(notification_id, chat_id, time, tz)
+            else:
+                self.unschedule_notification(notification_id)
+        self.changes_seq = changes[-1][0]
+        await self.repo.prune_notification_changes(self.changes_seq)
+        logger.info("Применено изменений уведомлений: %s", len(changes))
+
+    async def become_leader(self):
+        # Узел стал лидером кластера: загрузка всех запланированных задач и отправка очереди.
+        # Очередь разбирает только лидер, иначе каждый узел слал бы с полным лимитом Telegram на один токен
+        self.outbox.start()
+        self.schedule_regress_product_notification()
+        self.start_hydration()
 
-    def schedule_all_notifications(self):
-        # Планирование всех уведомлений из базы данных
-        notifications = self.get_notifications()
-        for chat_id, time in notifications:
-            self.schedule_notification(chat_id, time)
-        logger.info(f"Все уведомления запланированы: {notifications}")
+    async def step_down(self):
+        # Узел потерял лидерство: задачи и очередь отправки обрабатывает новый лидер.
+        # Захваченные, но не подтвержденные строки новый лидер отправит после истечения захвата
+        await self.outbox.stop()
+        self.stop_hydration()
+        self.scheduler.clear()
+        self.slots.clear()
+        self.notification_slots.clear()
 
     async def list_tasks_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /listtasks
-        tasks = self.get_tasks()
-        if tasks:
-            tasks_list = "\n".join(f"{i+1}. {task}" for i, task in enumerate(tasks))
-            await update.message.reply_text(f"Текущие задачи:\n{tasks_list}")
-        else:
-            await update.message.reply_text("Список задач пуст.")
+        text, reply_markup = await self.tasks_page()
+        await update.message.reply_text(text, reply_markup=reply_markup)
         logger.info("Команда /listtasks выполнена")
 
+    async def tasks_page(self, after_id=0, before_id=None):
+        # Формирование страницы списка задач
+        page = await self.task_list.get_page(after_id, before_id)
+        if not page.rows and (after_id or before_id is not None):
+            page = await self.task_list.get_page()
+        return render_task_page(page), self.page_keyboard('tasks', page)
+
     async def add_task_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /addtask
         await update.message.reply_text("Пожалуйста, введите задачу, которую хотите добавить.")
@@ -269,11 +420,53 @@ class NotificationBot:
     async def save_task(self, update: Update, context: CallbackContext):
         # Сохранение новой задачи
         task = update.message.text
-        self.add_task(task)
+        await self.repo.add_task(task)
         await update.message.reply_text(f"Задача '{task}' добавлена.")
-        logger.info(f"Добавлена задача: {task}")
+        logger.info("Добавлена задача: %s", task)
+        return ConversationHandler.END
+
+    async def import_tasks_command(self, update: Update, context: CallbackContext):
+        # Обработчик команды /importtasks
+        await update.message.reply_text("Пожалуйста, отправьте файл с задачами: .txt (одна задача на строку) или .csv (колонка task).")
+        return IMPORTING_TASKS
+
+    async def save_imported_tasks(self, update: Update, context: CallbackContext):
+        # Загрузка задач из файла одной транзакцией
+        document = update.message.document
+        if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+            await update.message.reply_text("Файл слишком большой: Telegram позволяет боту загружать файлы до 20 МБ.")
+            return ConversationHandler.END
+        started = time.monotonic()
+        file = await document.get_file()
+        data = await file.download_as_bytearray()
+        try:
+            tasks = parse_tasks(bytes(data), document.file_name or '')
+        except (UnicodeDecodeError, csv.Error):
+            await update.message.reply_text("Не удалось прочитать файл. Ожидается текст в кодировке UTF-8.")
+            return ConversationHandler.END
+        count = await self.repo.add_tasks(tasks)
+        await update.message.reply_text(f"Импортировано задач: {count} за {time.monotonic() - started:.2f} с.")
+        logger.info("Импортировано задач из файла %s: %s", document.file_name, count)
         return ConversationHandler.END
 
+    async def export_tasks_command(self, update: Update, context: CallbackContext):
+        # Обработчик команды /exporttasks: задачи читаются из базы порциями и пишутся в CSV во временный файл
+        started = time.monotonic()
+        with await asyncio.to_thread(tempfile.TemporaryFile) as file:
+            count, size = await write_tasks_csv(self.repo.iter_tasks(), file)
+            if size > MAX_EXPORT_SIZE:
+                await update.message.reply_text(
+                    f"Файл с задачами занимает {size / 1024 / 1024:.1f} МБ, а Telegram принимает от бота документы до 50 МБ. "
+                    "Удалите закрытые задачи или выгрузите их частями."
+                )
+                logger.warning("Экспорт задач не отправлен: файл %s байт больше лимита Telegram", size)
+                return
+            # Для отправки PTB читает файл целиком (до 50 МБ в памяти); чтение идет в потоке, а не в event loop
+            document = await asyncio.to_thread(InputFile, file, filename='tasks.csv')
+            caption = f"Экспортировано задач: {count} за {time.monotonic() - started:.2f} с."
+            await update.message.reply_document(document=document, caption=caption)
+        logger.info("Экспортировано задач: %s", count)
+
     async def cancel_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /cancel
         await update.message.reply_text("Добавление задачи отменено.")
@@ -282,87 +475,90 @@ class NotificationBot:
     async def close_task_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /closetask
         try:
-            task_number = int(context.args[0]) - 1
-            if self.delete_task(task_number):
-                await update.message.reply_text(f"Задача номер {task_number + 1} закрыта.")
-                logger.info(f"Задача номер {task_number + 1} закрыта")
+            task_id = int(context.args[0])
+            if await self.repo.delete_task(task_id):
+                await update.message.reply_text(f"Задача номер {task_id} закрыта.")
+                logger.info("Задача номер %s закрыта", task_id)
             else:
-                await update.message.reply_text(f"Задача номер {task_number + 1} не найдена.")
-                logger.info(f"Задача номер {task_number + 1} не найдена")
+                await update.message.reply_text(f"Задача номер {task_id} не найдена.")
+                logger.info("Задача номер %s не найдена", task_id)
         except (IndexError, ValueError):
             await update.message.reply_text("Пожалуйста, укажите корректный номер задачи.")
             logger.info("Некорректный номер задачи для команды /closetask")
 
-    async def send_task_list(self, chat_id):
-        # Метод для отправки списка задач
-        tasks = self.get_tasks()
-        if tasks:
-            tasks_list = "\n".join(f"{i+1}. {task}" for i, task in enumerate(tasks))
-            await self.application.bot.send_message(chat_id=chat_id, text=f"Текущие задачи:\n{tasks_list}")
-        else:
-            await self.application.bot.send_message(chat_id=chat_id, text="Список задач пуст.")
-        logger.info(f"Список задач отправлен в чат {chat_id}")
-
-    def add_task(self, task):
-        # Добавление задачи в базу данных
-        with self.conn_tasks:
-            self.conn_tasks.execute('INSERT INTO tasks (task) VALUES (?)', (task,))
-        logger.info(f"Задача '{task}' добавлена в базу данных")
-
-    def get_tasks(self):
-        # Получение всех задач из базы данных
-        with self.conn_tasks:
-            cursor = self.conn_tasks.execute('SELECT task FROM tasks')
-            tasks = [row[0] for row in cursor.fetchall()]
-        return tasks
-
-    def delete_task(self, task_number):
-        # Удаление задачи по номеру
-        tasks = self.get_tasks()
-        if 0 <= task_number < len(tasks):
-            task_to_delete = tasks[task_number]
-            with self.conn_tasks:
-                self.conn_tasks.execute('DELETE FROM tasks WHERE task = ?', (task_to_delete,))
-            logger.info(f"Задача '{task_to_delete}' удалена из базы данных")
-            return True
-        return False
+    async def find_task_command(self, update: Update, context: CallbackContext):
+        # Обработчик команды /findtask: поиск по полнотекстовому индексу задач
+        query = " ".join(context.args)
+        if not fts_query(query):
+            await update.message.reply_text("Пожалуйста, укажите слова для поиска. Пример: /findtask регресс")
+            return
+        rows = await self.repo.search_tasks(query)
+        await update.message.reply_text(render_search_results(query, rows), parse_mode=ParseMode.HTML)
+        logger.info("Команда /findtask выполнена: найдено задач %s", len(rows))
 
     async def start(self):
-        # Метод для запуска бота
+        # Метод для запуска бота: прием обновлений начинается до загрузки уведомлений
         await self.application.initialize()
         await self.application.start()
-        await self.application.updater.start_polling(drop_pending_updates=True)
-        logger.info("Бот запущен и работает в режиме polling")
+        await self.broadcaster.start()
+        await self.metrics.start()
+        if self.webhook is not None:
+            await self.webhook.start()
+            if WEBHOOK_URL:
+                await self.webhook.register(WEBHOOK_URL)
+            logger.info("Бот запущен и работает в режиме webhook")
+        else:
+            await self.application.updater.start_polling(drop_pending_updates=True)
+            logger.info("Бот запущен и работает в режиме polling")
+        if self.cluster is None:
+            self.outbox.start()
+            self.schedule_regress_product_notification()
+            self.start_hydration()
+        await self.set_commands()
 
     async def run_scheduler(self):
         # Метод для запуска шедулера
-        while True:
-            schedule.run_pending()
-            await asyncio.sleep(1)
-
-    def schedule_notify(self, chat_id):
-        # Метод для планирования уведомлений
-        asyncio.run_coroutine_threadsafe(self.notify_chat(chat_id), asyncio.get_event_loop())
-        logger.info(f"Запланированное уведомление отправлено в чат {chat_id}")
+        await self.scheduler.run()
 
-    async def notify_chat(self, chat_id):
-        # Метод для отправки уведомлений в чат
-        await self.send_task_list(chat_id)
-        logger.info(f"Уведомление отправлено в чат {chat_id}")
+    async def notify_slot(self, planned_at, time, tz):
+        # Постановка списка задач в очередь для всех чатов с уведомлением на это время: одно чтение списка и одна запись
+        chat_ids = set(self.slots.get((time, tz), {}).values())
+        if not chat_ids:
+            return
+        count = await self.outbox.enqueue(job_name(('notification_slot', time, tz)), planned_at, chat_ids, await self.task_list.get())
+        logger.info("Уведомления на %s (%s) поставлены в очередь: %s из %s", time, tz, count, len(chat_ids))
 
     async def run(self):
         # Метод для запуска бота и шедулера
+        tasks = [self.start(), self.run_scheduler()]
+        if self.cluster is not None:
+            tasks.append(self.cluster.run())
         try:
-            await asyncio.gather(self.start(), self.run_scheduler())
+            await asyncio.gather(*tasks)
         except asyncio.CancelledError:
             logger.info("Завершение работы бота и шедулера")
+        finally:
+            self.stop_hydration()
+            if self.webhook is not None:
+                await self.webhook.stop()
+            if self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            # При остановке приложение записывает накопленное состояние диалогов
+            await self.application.shutdown()
+            await self.persistence.close()
+            if self.cluster is not None:
+                await self.cluster.release()
+            await self.outbox.stop()
+            await self.broadcaster.stop()
+            await self.metrics.stop()
+            await self.repo.close()
 
     async def useful_links_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /useful_links
         try:
-            with open('useful_links.txt', 'r', encoding='utf-8') as file:
-                links = file.read()
-            await update.message.reply_text(links)
+            await update.message.reply_text(self.messages.get('useful_links'))
             logger.info("Команда /useful_links выполнена")
         except FileNotFoundError:
             await update.message.reply_text("Файл с полезными ссылками не найден.")
@@ -375,112 +571,77 @@ class NotificationBot:
             return
 
         regress_product = context.args[0]
-        self.add_regress_product(regress_product)
+        await self.repo.add_regress_product(regress_product)
         await update.message.reply_text(f"Регрессный продакт '{regress_product}' установлен.")
-        logger.info(f"Регрессный продакт '{regress_product}' установлен")
+        logger.info("Регрессный продакт '%s' установлен", regress_product)
 
     async def save_regress_product(self, update: Update, context: CallbackContext):
         # Сохранение регрессного продакта
         regress_product = update.message.text
-        self.add_regress_product(regress_product)
+        await self.repo.add_regress_product(regress_product)
         await update.message.reply_text(f"Регрессный продакт '{regress_product}' добавлен.")
-        logger.info(f"Добавлен регрессный продакт: {regress_product}")
+        logger.info("Добавлен регрессный продакт: %s", regress_product)
         return ConversationHandler.END
 
-    def add_regress_product(self, name):
-        # Добавление регрессного продакта в базу данных
-        with self.conn_notifications:
-            self.conn_notifications.execute('INSERT INTO regress_product (name) VALUES (?)', (name,))
-        logger.info(f"Регрессный продакт '{name}' добавлен в базу данных")
-
     async def current_regress_product_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /currentregressproduct
         if context.args:
             regress_product = context.args[0]
-            self.add_regress_product(regress_product)
+            await self.repo.add_regress_product(regress_product)
             await update.message.reply_text(f"Регрессный продакт '{regress_product}' установлен.")
-            logger.info(f"Регрессный продакт '{regress_product}' установлен")
+            logger.info("Регрессный продакт '%s' установлен", regress_product)
         else:
-            regress_product = self.get_current_regress_product()
+            regress_product = await self.repo.get_current_regress_product()
             if regress_product:
-                await update.message.reply_text(f"Текущий регрессный продакт: {regress_product}.\n\nДорогой, ты сегодня регрессный продакт.\nПросьба обновить tnps и отзывы. Вот ссылка: https://docs.google.com/spreadsheets/d/18kJ5GEui0bA0GiGiwe_ZUQd2l7-iwVe4QUCzvJLfmac/edit?usp=sharing")
+                await update.message.reply_text(self.messages.render('current_regress_product', product=regress_product))
             else:
                 await update.message.reply_text("Регрессный продакт не установлен.")
             logger.info("Команда /currentregressproduct выполнена")
 
-    def get_current_regress_product(self):
-        # Получение текущего регрессного продакта из базы данных
-        with self.conn_notifications:
-            cursor = self.conn_notifications.execute('SELECT name FROM regress_product ORDER BY id DESC LIMIT 1')
-            result = cursor.fetchone()
-        return result[0] if result else None
-
     def schedule_regress_product_notification(self):
         # Планирование уведомлений о регрессном продакте
-        schedule.every().wednesday.at("12:00").do(self.schedule_regress_product_notify)
+        self.scheduler.add_job('regress_product', DailyTrigger("12:00", 'Europe/Moscow', weekday=2), self.schedule_regress_product_notify)
         logger.info("Уведомления о регрессном продакте запланированы на каждую среду в 12:00 по Москве")
 
-    def schedule_regress_product_notify(self):
-        # Метод для планирования уведомлений о регрессном продакте
-        chat_ids = self.get_chat_ids()
-        for chat_id in chat_ids:
-            asyncio.run_coroutine_threadsafe(self.notify_regress_product(chat_id), asyncio.get_event_loop())
-        logger.info("Запланированное уведомление о регрессном продакте отправлено во все чаты")
+    async def schedule_regress_product_notify(self, planned_at):
+        # Метод для отправки запланированных уведомлений о регрессном продакте
+        await self.notify_regress_product(planned_at)
 
-    async def notify_regress_product(self, chat_id):
-        # Метод для отправки уведомлений о регрессном продакте в чат
-        regress_product = self.get_current_regress_product()
+    async def notify_regress_product(self, planned_at):
+        # Постановка уведомления о регрессном продакте в очередь для всех чатов
+        regress_product = await self.repo.get_current_regress_product()
         if regress_product:
-            message = f"Дорогой, ты сегодня регрессный продакт. Просьба обновить tnps и отзывы. Вот ссылка: https://docs.google.com/spreadsheets/d/18kJ5GEui0bA0GiGiwe_ZUQd2l7-iwVe4QUCzvJLfmac/edit?usp=sharing"
-            await self.application.bot.send_message(chat_id=chat_id, text=message)
-            logger.info(f"Уведомление о регрессном продакте отправлено в чат {chat_id}")
+            message = self.messages.render('regress_product')
+            count = await self.outbox.enqueue('regress_product', planned_at, await self.repo.get_chat_ids(), [message])
+            logger.info("Уведомление о регрессном продакте поставлено в очередь: %s чатов", count)
         else:
             logger.info("Регрессный продакт не установлен, уведомление не отправлено")
 
     async def remind_fill_table_command(self, update: Update, context: CallbackContext):
         # Скрытая команда для отправки напоминаний о заполнении таблички
         chat_id = update.effective_chat.id
-        message = "Напоминание: Пожалуйста, заполните табличку. Вот ссылка: https://docs.google.com/spreadsheets/d/18kJ5GEui0bA0GiGiwe_ZUQd2l7-iwVe4QUCzvJLfmac/edit?usp=sharing"
+        message = self.messages.render('remind_fill_table')
         await self.application.bot.send_message(chat_id=chat_id, text=message)
-        logger.info(f"Напоминание о заполнении таблички отправлено в чат {chat_id}")
+        logger.info("Напоминание о заполнении таблички отправлено в чат %s", chat_id)
 
     async def onboarding_command(self, update: Update, context: CallbackContext):
         # Обработчик команды /onboarding
-        message = (
-            "Добро пожаловать! Я бот для уведомлений и управления задачами. Вот как я могу вам помочь:\n\n"
-            "1. **Запуск и помощь**:\n"
-            "   - /start: Запустить бота и добавить текущий чат в базу данных.\n"
-            "   - /help: Показать список всех доступных команд.\n\n"
-            "2. **Управление задачами**:\n"
-            "   - /addtask: Начать процесс добавления новой задачи.\n"
-            "   - /listtasks: Показать список всех текущих задач.\n"
-            "   - /closetask <номер>: Закрыть задачу по её номеру.\n\n"
-            "3. **Уведомления**:\n"
-            "   - /setnotification <время>: Установить ежедневное уведомление на указанное время (формат ЧЧ:ММ).\n"
-            "   - /listnotifications: Показать список всех текущих уведомлений.\n"
-            "   - /deletenotification <номер>: Удалить уведомление по его номеру.\n"
-            "   - /notify: Отправить список задач во все чаты.\n\n"
-            "4. **Полезные ссылки**:\n"
-            "   - /useful_links: Показать список полезных ссылок.\n\n"
-            "5. **Регрессный продакт**:\n"
-            "   - /setregressproduct <@имя>: Установить текущего регрессного продакта.\n"
-            "   - /currentregressproduct: Показать текущего регрессного продакта.\n\n"
-            "6. **Напоминания**:\n"
-            "   - /remind_fill_table: Отправить напоминание о заполнении таблички.\n\n"
-            "Если у вас есть вопросы или нужна помощь, используйте команду /help. Удачи!"
-        )
-        await update.message.reply_text(message)
+        await update.message.reply_text(self.messages.get('onboarding'))
         logger.info("Команда /onboarding выполнена")
 
 if __name__ == "__main__":
-    load_dotenv()
+    # Логи пишутся в фоновом потоке; при остановке очередь записей дописывается
+    log_listener = setup_logging()
     token = os.getenv('TELEGRAM_BOT_TOKEN')
     
-    if not token:
-        logger.error("Токен не найден в файле .env")
-    else:
-        bot = NotificationBot(token)
-        try:
-            asyncio.run(bot.run())
-        except KeyboardInterrupt:
-            logger.info("Бот остановлен пользователем")
+    try:
+        if not token:
+            logger.error("Токен не найден в файле .env")
+        else:
+            bot = NotificationBot(token)
+            try:
+                asyncio.run(bot.run())
+            except KeyboardInterrupt:
+                logger.info("Бот остановлен пользователем")
+    finally:
+        log_listener.stop()
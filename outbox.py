@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from broadcast import BLOCKED, FAILED, SENT
+from metrics import OUTBOX_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк диспетчер забирает из очереди за одну транзакцию
+OUTBOX_BATCH = int(os.getenv('OUTBOX_BATCH', '200'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+# Захваченные строки, не подтвержденные за это время (процесс упал), отправляются повторно
+OUTBOX_CLAIM_TTL = 300
+# Насколько давние пропущенные срабатывания досылаются после перезапуска
+CATCHUP_WINDOW = float(os.getenv('OUTBOX_CATCHUP_WINDOW', str(6 * 3600)))
+# Как долго хранятся обработанные строки: ключи защищают от повторной постановки в очередь
+OUTBOX_RETENTION = 2 * 24 * 3600
+# Как часто диспетчер отмечает в job_checkpoints, что процесс работает. Для задач, которые еще ни разу
+# не срабатывали, отметка - время, с которого досылаются пропущенные срабатывания
+ALIVE_INTERVAL = 30
+ALIVE_CHECKPOINT = '@alive'
+
+PENDING = 'pending'
+
+
+class Outbox:
+    # Надежная очередь исходящих сообщений в SQLite: доставка хотя бы один раз
+    def __init__(self, db, broadcaster, batch=OUTBOX_BATCH, poll_interval=OUTBOX_POLL_INTERVAL,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, claim_ttl=OUTBOX_CLAIM_TTL):
+        self.db = db
+        self.broadcaster = broadcaster
+        self.batch = batch
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.claim_ttl = claim_ttl
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.last_prune = 0.0
+        self.last_alive_mark = 0.0
+
+    async def enqueue(self, job, planned_at, chat_ids, messages):
+        # Постановка срабатывания задачи в очередь одной транзакцией; повторная постановка игнорируется
+        count = await self.db.transaction(self._enqueue, job, planned_at, list(chat_ids), json.dumps(list(messages), ensure_ascii=False))
+        self.wakeup.set()
+        return count
+
+    @staticmethod
+    def _enqueue(conn, job, planned_at, chat_ids, payload):
+        # Текст записывается один раз на срабатывание, строки чатов ссылаются на него
+        now = time.time()
+        fire = f"{job}@{planned_at}"
+        conn.execute('INSERT OR IGNORE INTO outbox_payloads (key, messages, created_at) VALUES (?, ?, ?)', (fire, payload, now))
+        payload_id = conn.execute('SELECT id FROM outbox_payloads WHERE key = ?', (fire,)).fetchone()[0]
+        cursor = conn.executemany(
+            'INSERT OR IGNORE INTO outbox (key, chat_id, payload_id, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+            ((f"{fire}:{chat_id}", chat_id, payload_id, now, now) for chat_id in chat_ids),
+        )
+        conn.execute('''
+            INSERT INTO job_checkpoints (job, fired_at) VALUES (?, ?)
+            ON CONFLICT (job) DO UPDATE SET fired_at = MAX(fired_at, excluded.fired_at)
+        ''', (job, planned_at))
+        return cursor.rowcount
+
+    async def get_checkpoints(self):
+        # Время последнего срабатывания каждой задачи, поставленного в очередь
+        return dict(await self.db.fetchall('SELECT job, fired_at FROM job_checkpoints WHERE job != ?', (ALIVE_CHECKPOINT,)))
+
+    async def get_last_alive(self):
+        # Последняя отметка о работе диспетчера (этого или предыдущего процесса), None - отметок не было
+        row = await self.db.fetchone('SELECT fired_at FROM job_checkpoints WHERE job = ?', (ALIVE_CHECKPOINT,))
+        return row[0] if row else None
+
+    def start(self):
+        if self.dispatcher is None:
+            # Первая отметка пишется через ALIVE_INTERVAL: к этому времени загрузка расписания прочитает предыдущую
+            self.last_alive_mark = time.monotonic()
+            self.dispatcher = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            await asyncio.gather(self.dispatcher, return_exceptions=True)
+            self.dispatcher = None
+
+    async def run(self):
+        # Диспетчер: захват порции строк, отправка через рассылку и подтверждение результата
+        while True:
+            try:
+                await self.mark_alive()
+                rows = await self.db.transaction(self._claim, self.batch, self.claim_ttl)
+                if rows:
+                    await self.dispatch(rows)
+                    continue
+                await self.prune()
+            except Exception:
+                logger.exception("Ошибка диспетчера очереди отправки")
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def _claim(conn, limit, ttl):
+        now = time.time()
+        return conn.execute('''
+            UPDATE outbox SET claimed_until = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ? AND claimed_until < ?
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            RETURNING id, chat_id, payload_id, attempts
+        ''', (now + ttl, now, now, limit)).fetchall()
+
+    async def dispatch(self, rows):
+        # Строки одного чата объединяются в одну доставку, чтобы сохранить порядок сообщений.
+        # Каждый текст читается и декодируется один раз на порцию
+        payloads = await self._load_payloads({payload_id for _, _, payload_id, _ in rows})
+        by_chat = {}
+        for row_id, chat_id, payload_id, attempts in sorted(rows):
+            ids, texts = by_chat.setdefault(chat_id, ([], []))
+            ids.append((row_id, attempts))
+            texts.extend(payloads[payload_id])
+        result = await self.broadcaster.deliver((chat_id, texts) for chat_id, (_, texts) in by_chat.items())
+        blocked, failed = set(result.blocked), set(result.failed)
+        now = time.time()
+        acks = []
+        for chat_id, (ids, _) in by_chat.items():
+            for row_id, attempts in ids:
+                if chat_id in blocked:
+                    acks.append((BLOCKED, now, 0, row_id))
+                elif chat_id not in failed:
+                    acks.append((SENT, now, 0, row_id))
+                elif attempts >= self.max_attempts:
+                    acks.append((FAILED, now, 0, row_id))
+                else:
+                    # Повтор с экспоненциальной задержкой
+                    acks.append((PENDING, now + min(30 * 2 ** attempts, 3600), 0, row_id))
+        await self.db.executemany('UPDATE outbox SET status = ?, next_attempt_at = ?, claimed_until = ? WHERE id = ?', acks)
+        for status, *_ in acks:
+            OUTBOX_MESSAGES.labels(status).inc()
+
+    async def _load_payloads(self, payload_ids):
+        placeholders = ', '.join('?' * len(payload_ids))
+        rows = await self.db.fetchall(
+            f'SELECT id, messages FROM outbox_payloads WHERE id IN ({placeholders})', tuple(payload_ids), label='load_payloads',
+        )
+        return {payload_id: json.loads(messages) for payload_id, messages in rows}
+
+    async def mark_alive(self):
+        if time.monotonic() - self.last_alive_mark < ALIVE_INTERVAL:
+            return
+        self.last_alive_mark = time.monotonic()
+        await self.db.execute('''
+            INSERT INTO job_checkpoints (job, fired_at) VALUES (?, ?)
+            ON CONFLICT (job) DO UPDATE SET fired_at = excluded.fired_at
+        ''', (ALIVE_CHECKPOINT, time.time()))
+
+    async def prune(self):
+        # Удаление обработанных строк старше срока хранения
+        if time.time() - self.last_prune < 3600:
+            return
+        self.last_prune = time.time()
+        await self.db.execute("DELETE FROM outbox WHERE status != 'pending' AND created_at < ?", (time.time() - OUTBOX_RETENTION,))
+        await self.db.execute(
+            'DELETE FROM outbox_payloads WHERE created_at < ? AND id NOT IN (SELECT payload_id FROM outbox)',
+            (time.time() - OUTBOX_RETENTION,),
+        )
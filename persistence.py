@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+from copy import deepcopy
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import PERSISTENCE_MIGRATIONS, Database, migrate
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_PATH = os.getenv('PERSISTENCE_PATH', 'state.db')
+# Как часто состояние диалогов и данные чатов записываются в базу
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', '0.3'))
+
+USER = 'user'
+CHAT = 'chat'
+CONVERSATION = 'conversation:'
+
+
+class SQLitePersistence(BasePersistence):
+    # Хранение состояния диалогов и данных пользователей и чатов в SQLite.
+    # Чтение идет из кеша в памяти; изменения накапливаются и записываются одной транзакцией раз в flush_interval
+    def __init__(self, path=PERSISTENCE_PATH, flush_interval=PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=flush_interval,
+        )
+        self.flush_interval = flush_interval
+        self.db = Database(path)
+        self.db.run_sync(migrate, PERSISTENCE_MIGRATIONS)
+        self.cache = None
+        # Несохраненные изменения: (вид, ключ) -> данные или None для удаления
+        self.dirty = {}
+        self.flush_handle = None
+        self.flushes = set()
+
+    async def _load(self):
+        # Чтение всех сохраненных данных в кеш при первом обращении
+        if self.cache is None:
+            self.cache = {}
+            for kind, key, data in await self.db.fetchall('SELECT kind, key, data FROM persistence'):
+                self.cache.setdefault(kind, {})[self._decode_key(kind, key)] = pickle.loads(data)
+        return self.cache
+
+    @staticmethod
+    def _encode_key(kind, key):
+        return json.dumps(list(key)) if kind.startswith(CONVERSATION) else str(key)
+
+    @staticmethod
+    def _decode_key(kind, key):
+        return tuple(json.loads(key)) if kind.startswith(CONVERSATION) else int(key)
+
+    async def _get(self, kind):
+        return deepcopy((await self._load()).get(kind, {}))
+
+    async def _set(self, kind, key, data):
+        # Изменение кеша и отложенная запись; неизмененные данные не записываются
+        entries = (await self._load()).setdefault(kind, {})
+        if data is None:
+            if entries.pop(key, None) is None:
+                return
+        elif entries.get(key) == data:
+            return
+        else:
+            entries[key] = deepcopy(data)
+        self.dirty[(kind, key)] = entries.get(key)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self.flush_handle = None
+        task = asyncio.get_running_loop().create_task(self._write_dirty())
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def _write_dirty(self):
+        dirty, self.dirty = self.dirty, {}
+        if not dirty:
+            return
+        upserts = [(kind, self._encode_key(kind, key), pickle.dumps(data)) for (kind, key), data in dirty.items() if data is not None]
+        deletes = [(kind, self._encode_key(kind, key)) for (kind, key), data in dirty.items() if data is None]
+        try:
+            await self.db.transaction(self._write, upserts, deletes)
+        except Exception:
+            logger.exception("Не удалось сохранить состояние диалогов")
+            # Изменения вернутся в очередь, если после них не было более новых
+            for item, data in dirty.items():
+                self.dirty.setdefault(item, data)
+
+    @staticmethod
+    def _write(conn, upserts, deletes):
+        conn.executemany('INSERT OR REPLACE INTO persistence (kind, key, data) VALUES (?, ?, ?)', upserts)
+        conn.executemany('DELETE FROM persistence WHERE kind = ? AND key = ?', deletes)
+
+    async def get_user_data(self):
+        return await self._get(USER)
+
+    async def get_chat_data(self):
+        return await self._get(CHAT)
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await self._get(CONVERSATION + name)
+
+    async def update_conversation(self, name, key, new_state):
+        await self._set(CONVERSATION + name, key, new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self._set(USER, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._set(CHAT, chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._set(USER, user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        await self._set(CHAT, chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Немедленная запись накопленных изменений (вызывается при остановке приложения)
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.flushes:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
+        await self._write_dirty()
+
+    async def close(self):
+        await self.flush()
+        await self.db.close()
@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from metrics import SCHEDULER_CATCHUP, SCHEDULER_LATENESS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = os.getenv('BOT_TIMEZONE', 'Europe/Moscow')
+
+# Максимальный интервал сна: защищает от переводов системных часов
+MAX_SLEEP = 60
+
+
+class DailyTrigger:
+    def __init__(self, at, tz=DEFAULT_TIMEZONE, weekday=None):
+        self.at = at
+        self.time = datetime.strptime(at, "%H:%M").time()
+        self.tz = pytz.timezone(tz)
+        self.weekday = weekday
+
+    def next_fire(self, after):
+        # Ближайшее время срабатывания (unix time) строго после after
+        after = datetime.fromtimestamp(after, pytz.utc)
+        day = after.astimezone(self.tz).date()
+        while True:
+            candidate = self.tz.localize(datetime.combine(day, self.time))
+            if candidate > after and (self.weekday is None or candidate.weekday() == self.weekday):
+                return candidate.timestamp()
+            day += timedelta(days=1)
+
+    def __repr__(self):
+        return f"{self.at} {self.tz.zone}" + (f" (день недели {self.weekday})" if self.weekday is not None else "")
+
+
+def job_name(key):
+    # Строковое имя задачи для базы данных: ('notification_slot', '10:00', 'UTC') -> notification_slot:10:00:UTC
+    return ':'.join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+def daily_window(tz, after, horizon):
+    # Интервал местного времени (ЧЧ:ММ, ЧЧ:ММ), в который попадают ежедневные срабатывания за horizon секунд
+    if horizon >= 24 * 3600:
+        return None
+    start = datetime.fromtimestamp(after, pytz.timezone(tz))
+    end = datetime.fromtimestamp(after + horizon, pytz.timezone(tz))
+    return start.strftime("%H:%M"), end.strftime("%H:%M")
+
+
+class OnceTrigger:
+    def __init__(self, when):
+        self.when = when
+        self.scheduled = False
+
+    def next_fire(self, after):
+        # Однократное срабатывание (просроченное - сразу); после него задача удаляется из планировщика
+        if self.scheduled:
+            return None
+        self.scheduled = True
+        return self.when
+
+    def __repr__(self):
+        return f"однократно в {datetime.fromtimestamp(self.when)}"
+
+
+class Job:
+    __slots__ = ('key', 'trigger', 'callback', 'args', 'next_run', 'cancelled')
+
+    def __init__(self, key, trigger, callback, args):
+        self.key = key
+        self.trigger = trigger
+        self.callback = callback
+        self.args = args
+        self.next_run = None
+        self.cancelled = False
+
+
+class TimerScheduler:
+    # Задача вызывается как callback(planned_at, *args), где planned_at - плановое время срабатывания
+    def __init__(self, guard=None):
+        # guard(key, planned_at) - корутина, разрешающая запуск задачи (например, только на лидере кластера)
+        self.guard = guard
+        self.heap = []
+        self.jobs = {}
+        self.cancelled = 0
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.running = set()
+
+    def add_job(self, key, trigger, callback, *args):
+        # Добавление задачи в кучу; задача с тем же ключом заменяется
+        self.cancel_job(key)
+        job = Job(key, trigger, callback, args)
+        job.next_run = trigger.next_fire(time.time())
+        if job.next_run is None:
+            return None
+        self.jobs[key] = job
+        self._push(job)
+        return job
+
+    def cancel_job(self, key):
+        # Отмена задачи: запись в куче помечается и удаляется при извлечении
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        self.cancelled += 1
+        if self.cancelled > len(self.heap) // 2:
+            self._compact()
+        return True
+
+    def clear(self):
+        # Удаление всех задач
+        for job in self.jobs.values():
+            job.cancelled = True
+        self.jobs.clear()
+        self.heap.clear()
+        self.cancelled = 0
+        self.wakeup.set()
+
+    def catch_up(self, last_fired, window, now=None, last_alive=None):
+        # Запуск срабатываний, пропущенных после last_fired[имя задачи] (например, пока бот был остановлен).
+        # Задачи, которые еще не срабатывали, досылаются с момента last_alive - последней отметки о работе бота
+        now = time.time() if now is None else now
+        missed = 0
+        for job in list(self.jobs.values()):
+            after = last_fired.get(job_name(job.key), last_alive)
+            if after is None:
+                continue
+            planned_at = None
+            fire_at = job.trigger.next_fire(max(after, now - window))
+            while fire_at is not None and fire_at <= now:
+                planned_at = fire_at
+                fire_at = job.trigger.next_fire(fire_at)
+            if planned_at is not None:
+                logger.info("Пропущенное срабатывание задачи %s на %s", job_name(job.key), datetime.fromtimestamp(planned_at))
+                self._fire(job, planned_at, catch_up=True)
+                missed += 1
+        return missed
+
+    def _push(self, job):
+        heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+        if self.heap[0][2] is job:
+            self.wakeup.set()
+
+    def _compact(self):
+        # Перестроение кучи без отмененных задач
+        self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+        heapq.heapify(self.heap)
+        self.cancelled = 0
+
+    async def run(self):
+        # Основной цикл: сон ровно до ближайшего срабатывания
+        while True:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+                self.cancelled -= 1
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, job = heapq.heappop(self.heap)
+            self._fire(job, job.next_run)
+            job.next_run = job.trigger.next_fire(max(job.next_run, time.time()))
+            if job.next_run is not None:
+                self._push(job)
+            elif self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+
+    def _fire(self, job, planned_at, catch_up=False):
+        # Запуск задачи в отдельной корутине, чтобы не задерживать остальные.
+        # Досылка опаздывает на время простоя бота, поэтому она считается отдельно и не попадает в гистограмму опозданий
+        label = job.key[0] if isinstance(job.key, tuple) else job.key
+        if catch_up:
+            SCHEDULER_CATCHUP.labels(label).inc()
+        else:
+            SCHEDULER_LATENESS.labels(label).observe(max(0.0, time.time() - planned_at))
+        if self.guard is None:
+            coro = job.callback(planned_at, *job.args)
+        else:
+            coro = self._guarded(job.key, planned_at, job.callback, job.args)
+        task = asyncio.get_running_loop().create_task(coro)
+        self.running.add(task)
+        task.add_done_callback(self._job_done)
+
+    async def _guarded(self, key, planned_at, callback, args):
+        if await self.guard(key, planned_at):
+            await callback(planned_at, *args)
+
+    def _job_done(self, task):
+        self.running.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Ошибка при выполнении запланированной задачи", exc_info=task.exception())
@@ -0,0 +1,655 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from metrics import DB_QUERY_LATENCY, query_label
+from scheduler import DEFAULT_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# Окно группового коммита: записи, пришедшие за это время, попадают в одну транзакцию
+GROUP_COMMIT_WINDOW = float(os.getenv('DB_GROUP_COMMIT_WINDOW', '0.005'))
+# Размер кеша подготовленных выражений sqlite3 на соединение
+CACHED_STATEMENTS = 256
+# Размер порции при потоковом чтении уведомлений
+HYDRATION_CHUNK = int(os.getenv('HYDRATION_CHUNK', '1000'))
+# Максимальное количество результатов поиска задач
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', '10'))
+# Результаты сортируются по релевантности (bm25), только если совпадений не больше этого числа:
+# bm25 читает все совпадения, а для частых слов достаточно самых новых задач
+SEARCH_RANK_LIMIT = 1000
+# Слов вокруг совпадения во фрагменте результата поиска
+SNIPPET_TOKENS = 12
+# Границы совпадения во фрагменте: управляющие символы не встречаются в тексте задач
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+# Страница выборки: строки и наличие соседних страниц
+Page = namedtuple('Page', ['rows', 'has_prev', 'has_next'])
+
+
+class Database:
+    def __init__(self, path, group_commit_window=GROUP_COMMIT_WINDOW):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.group_commit_window = group_commit_window
+        # Один поток на файл базы: все обращения к соединению идут через него
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-{os.path.basename(path)}")
+        self.conn = self.executor.submit(self._connect).result()
+        self.pending = []
+        self.flush_handle = None
+        self.flushes = set()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=CACHED_STATEMENTS)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def run_sync(self, fn, *args):
+        # Синхронный вызов fn(conn, *args) в потоке базы (только до запуска event loop)
+        return self.executor.submit(fn, self.conn, *args).result()
+
+    async def run(self, fn, *args):
+        # Вызов fn(conn, *args) в потоке базы без блокировки event loop
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, self.conn, *args)
+
+    def _timed(self, label, fn, *args):
+        # Выполнение в потоке базы с замером времени запроса
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            DB_QUERY_LATENCY.labels(self.name, label).observe(time.perf_counter() - started)
+
+    # label - метка запроса в метриках. Без нее метка строится из текста SQL, поэтому для запросов,
+    # текст которых меняется (списки IN, необязательные условия), метку нужно передавать явно
+
+    async def fetchall(self, sql, params=(), label=None):
+        return await self.run(lambda conn: self._timed(label or query_label(sql), lambda: conn.execute(sql, params).fetchall()))
+
+    async def fetchone(self, sql, params=(), label=None):
+        return await self.run(lambda conn: self._timed(label or query_label(sql), lambda: conn.execute(sql, params).fetchone()))
+
+    async def transaction(self, fn, *args):
+        # Выполнение fn(conn, *args) в отдельной транзакции
+        return await self.run(lambda conn: self._timed(fn.__name__, self._transaction, conn, fn, *args))
+
+    @staticmethod
+    def _transaction(conn, fn, *args):
+        conn.execute('BEGIN')
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    async def execute(self, sql, params=(), label=None):
+        # Запись через групповой коммит
+        return await self._enqueue(sql, params, False, label)
+
+    async def executemany(self, sql, seq_of_params, label=None):
+        return await self._enqueue(sql, list(seq_of_params), True, label)
+
+    async def _enqueue(self, sql, params, many, label):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((sql, params, many, label, future))
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.group_commit_window, self._flush)
+        return await future
+
+    def _flush(self):
+        # Отправка накопленных записей в поток базы одной транзакцией
+        self.flush_handle = None
+        batch, self.pending = self.pending, []
+        task = asyncio.get_running_loop().create_task(self._commit(batch))
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def _commit(self, batch):
+        statements = [(sql, params, many, label) for sql, params, many, label, _ in batch]
+        try:
+            results = await self.run(self._write_batch, statements)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (*_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _write_batch(self, conn, statements):
+        # Каждая запись в своей точке сохранения: ошибка одной не откатывает остальные
+        results = []
+        conn.execute('BEGIN')
+        try:
+            for sql, params, many, label in statements:
+                conn.execute('SAVEPOINT write')
+                try:
+                    cursor = self._timed(label or query_label(sql), conn.executemany if many else conn.execute, sql, params)
+                    results.append(WriteResult(cursor.lastrowid, cursor.rowcount))
+                    conn.execute('RELEASE write')
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO write')
+                    conn.execute('RELEASE write')
+                    results.append(e)
+            self._timed('COMMIT', conn.execute, 'COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return results
+
+    async def close(self):
+        # Дописывание накопленных записей и закрытие соединения
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self._flush()
+        if self.flushes:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
+        await self.run(lambda conn: conn.close())
+        self.executor.shutdown()
+
+
+def migrate(conn, migrations):
+    # Применение недостающих миграций; номер версии схемы хранится в PRAGMA user_version
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, migration in migrations:
+        if version <= current:
+            continue
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        logger.info("Миграция %s применена к базе", version)
+
+
+def _create_tasks_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY
+        )
+    ''')
+
+
+def _create_tasks_search(conn):
+    # Полнотекстовый индекс задач (FTS5) поверх таблицы tasks, синхронизируется триггерами.
+    # Префиксные индексы (2-5 символов) ускоряют поиск по началу слова; существующие задачи индексируются командой rebuild
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            task, content='tasks', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, task) VALUES (new.id, new.task);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, task) VALUES ('delete', old.id, old.task);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF task ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, task) VALUES ('delete', old.id, old.task);
+            INSERT INTO tasks_fts (rowid, task) VALUES (new.id, new.task);
+        END
+    ''')
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+
+def fts_query(text):
+    # Запрос FTS5 из пользовательского текста: каждое слово в кавычках (синтаксис FTS5 не интерпретируется),
+    # последнее слово ищется и по началу; все слова должны встретиться в задаче
+    words = [f'"{word}"' for word in re.findall(r'\w+', text)]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def _create_notifications_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            time TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS regress_product (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        )
+    ''')
+
+
+def _add_notifications_tz(conn):
+    # Часовой пояс уведомления: старые записи считаются московскими
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(notifications)')]
+    if 'tz' not in columns:
+        conn.execute(f"ALTER TABLE notifications ADD COLUMN tz TEXT NOT NULL DEFAULT '{DEFAULT_TIMEZONE}'")
+
+
+def _add_notifications_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_chat_id ON notifications (chat_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_time ON notifications (time)')
+
+
+def _add_cluster_tables(conn):
+    # Аренда лидерства, отметки о выполненных задачах и журнал изменений уведомлений для лидера
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_claims (
+            job TEXT NOT NULL,
+            planned_at REAL NOT NULL,
+            node TEXT NOT NULL,
+            PRIMARY KEY (job, planned_at)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_job_claims_planned_at ON job_claims (planned_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notification_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            notification_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS notifications_insert_log AFTER INSERT ON notifications BEGIN
+            INSERT INTO notification_changes (notification_id, op) VALUES (new.id, 'insert');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS notifications_delete_log AFTER DELETE ON notifications BEGIN
+            INSERT INTO notification_changes (notification_id, op) VALUES (old.id, 'delete');
+        END
+    ''')
+
+
+def _unique_notifications(conn):
+    # Одно уведомление на чат и время: дубликаты удаляются, индекс по chat_id заменяется уникальным
+    conn.execute('''
+        DELETE FROM notifications WHERE id NOT IN (
+            SELECT MIN(id) FROM notifications GROUP BY chat_id, time, tz
+        )
+    ''')
+    conn.execute('DROP INDEX IF EXISTS idx_notifications_chat_id')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_chat_time ON notifications (chat_id, time, tz)')
+
+
+def _create_outbox_tables(conn):
+    # Очередь исходящих сообщений с ключами идемпотентности и время последнего срабатывания задач
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            messages TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_until REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt_at) WHERE status = 'pending'")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_created_at ON outbox (created_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_checkpoints (
+            job TEXT PRIMARY KEY,
+            fired_at REAL NOT NULL
+        )
+    ''')
+
+
+def _outbox_payloads(conn):
+    # Текст сообщений хранится один раз на срабатывание (ключ задача@время), строки очереди ссылаются на него
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_payloads (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            messages TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('ALTER TABLE outbox ADD COLUMN payload_id INTEGER')
+    # Перенос уже поставленных строк: ключ срабатывания - ключ строки без chat_id
+    rows = conn.execute('SELECT id, key, messages, created_at FROM outbox').fetchall()
+    for row_id, key, messages, created_at in rows:
+        payload_key = key.rsplit(':', 1)[0]
+        conn.execute(
+            'INSERT OR IGNORE INTO outbox_payloads (key, messages, created_at) VALUES (?, ?, ?)',
+            (payload_key, messages, created_at),
+        )
+        conn.execute(
+            'UPDATE outbox SET payload_id = (SELECT id FROM outbox_payloads WHERE key = ?) WHERE id = ?',
+            (payload_key, row_id),
+        )
+    conn.execute('ALTER TABLE outbox DROP COLUMN messages')
+
+
+def normalize_notification(time, tz):
+    # Каноническая запись времени (ЧЧ:ММ) и часового пояса (имя IANA с исходным регистром).
+    # Некорректные значения возвращаются без изменений
+    try:
+        time = datetime.strptime(time, "%H:%M").strftime("%H:%M")
+    except ValueError:
+        pass
+    try:
+        tz = pytz.timezone(tz).zone
+    except pytz.UnknownTimeZoneError:
+        pass
+    return time, tz
+
+
+def _normalize_notifications(conn):
+    # Старые записи могли хранить 9:00 или europe/moscow: такие уведомления не совпадали с 09:00 и Europe/Moscow
+    # в уникальном индексе и срабатывали дважды. Дубликаты после нормализации удаляются, остальные записи обновляются
+    kept = {}
+    duplicates = []
+    updates = []
+    for notification_id, chat_id, time, tz in conn.execute('SELECT id, chat_id, time, tz FROM notifications ORDER BY id'):
+        normalized = normalize_notification(time, tz)
+        key = (chat_id, *normalized)
+        if key in kept:
+            duplicates.append((notification_id,))
+            continue
+        kept[key] = notification_id
+        if normalized != (time, tz):
+            updates.append((*normalized, notification_id))
+    conn.executemany('DELETE FROM notifications WHERE id = ?', duplicates)
+    conn.executemany('UPDATE notifications SET time = ?, tz = ? WHERE id = ?', updates)
+
+
+def _drop_change_log_triggers(conn):
+    # Журнал изменений нужен только кластеру: триггеры создаются при запуске в режиме кластера (см. set_change_log)
+    conn.execute('DROP TRIGGER IF EXISTS notifications_insert_log')
+    conn.execute('DROP TRIGGER IF EXISTS notifications_delete_log')
+    conn.execute('DELETE FROM notification_changes')
+
+
+def set_change_log(conn, enabled):
+    # Включение журнала notification_changes. Без кластера журнал некому читать и чистить,
+    # поэтому вне кластера триггеры удаляются вместе с накопленными записями
+    conn.execute('BEGIN')
+    try:
+        if enabled:
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS notifications_insert_log AFTER INSERT ON notifications BEGIN
+                    INSERT INTO notification_changes (notification_id, op) VALUES (new.id, 'insert');
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS notifications_delete_log AFTER DELETE ON notifications BEGIN
+                    INSERT INTO notification_changes (notification_id, op) VALUES (old.id, 'delete');
+                END
+            ''')
+        else:
+            _drop_change_log_triggers(conn)
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _create_persistence_tables(conn):
+    # Состояние диалогов и данные пользователей и чатов python-telegram-bot
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+    ''')
+
+
+# Миграции схемы: (версия, функция). Новые миграции добавляются только в конец списка
+TASKS_MIGRATIONS = [
+    (1, _create_tasks_tables),
+    (2, _create_tasks_search),
+]
+NOTIFICATIONS_MIGRATIONS = [
+    (1, _create_notifications_tables),
+    (2, _add_notifications_tz),
+    (3, _add_notifications_indexes),
+    (4, _add_cluster_tables),
+    (5, _unique_notifications),
+    (6, _create_outbox_tables),
+    (7, _outbox_payloads),
+    (8, _normalize_notifications),
+    (9, _drop_change_log_triggers),
+]
+PERSISTENCE_MIGRATIONS = [
+    (1, _create_persistence_tables),
+]
+
+
+class Repository:
+    def __init__(self, tasks_path='tasks.db', notifications_path='notifications.db'):
+        self.tasks_db = Database(tasks_path)
+        self.notifications_db = Database(notifications_path)
+        # Версия списка задач: увеличивается при каждом изменении таблицы tasks
+        self.tasks_version = 0
+        # В кластере базу меняют и другие процессы: их коммиты видны по PRAGMA data_version
+        self.shared = False
+        self.tasks_data_version = None
+
+    def create_tables(self, change_log=False):
+        # Создание таблиц и применение миграций схемы; change_log включает журнал изменений уведомлений для кластера
+        self.tasks_db.run_sync(migrate, TASKS_MIGRATIONS)
+        self.notifications_db.run_sync(migrate, NOTIFICATIONS_MIGRATIONS)
+        self.notifications_db.run_sync(set_change_log, change_log)
+        logger.info("Таблицы созданы или уже существуют")
+
+    async def add_chat(self, chat_id):
+        # Добавление чата в базу данных
+        await self.tasks_db.execute('INSERT OR IGNORE INTO chats (id) VALUES (?)', (chat_id,))
+        logger.info("Чат %s добавлен в базу данных", chat_id)
+
+    async def prune_chats(self, chat_ids):
+        # Удаление чатов, в которых бот заблокирован или из которых удален
+        await self.tasks_db.executemany('DELETE FROM chats WHERE id = ?', [(chat_id,) for chat_id in chat_ids])
+        logger.info("Удалено недоступных чатов: %s", len(chat_ids))
+
+    async def get_chat_ids(self):
+        # Получение всех идентификаторов чатов из базы данных
+        rows = await self.tasks_db.fetchall('SELECT id FROM chats')
+        return [row[0] for row in rows]
+
+    async def add_notification(self, chat_id, time, tz):
+        # Добавление уведомления в базу данных; None, если такое уведомление уже есть
+        result = await self.notifications_db.execute('INSERT OR IGNORE INTO notifications (chat_id, time, tz) VALUES (?, ?, ?)', (chat_id, time, tz))
+        if not result.rowcount:
+            return None
+        logger.info("Уведомление для чата %s добавлено на %s (%s)", chat_id, time, tz)
+        return result.lastrowid
+
+    async def iter_notifications(self, tz=None, window=None, chunk_size=HYDRATION_CHUNK):
+        # Потоковое чтение уведомлений порциями по id; window - (начало, конец) местного времени ЧЧ:ММ
+        conditions, params = ['id > ?'], []
+        if tz is not None:
+            conditions.append('tz = ?')
+            params.append(tz)
+        if window is not None:
+            start, end = window
+            # Окно может переходить через полночь
+            conditions.append('(time >= ? AND time < ?)' if start <= end else '(time >= ? OR time < ?)')
+            params.extend(window)
+        sql = f"SELECT id, chat_id, time, tz FROM notifications WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+        last_id = 0
+        while True:
+            rows = await self.notifications_db.fetchall(sql, (last_id, *params, chunk_size), label='iter_notifications')
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    async def get_notification_timezones(self):
+        # Часовые пояса, в которых есть уведомления
+        return [tz for tz, in await self.notifications_db.fetchall('SELECT DISTINCT tz FROM notifications')]
+
+    async def get_notification_changes_seq(self):
+        # Номер последнего изменения в журнале уведомлений
+        return (await self.notifications_db.fetchone('SELECT COALESCE(MAX(seq), 0) FROM notification_changes'))[0]
+
+    async def get_notification_changes(self, after_seq):
+        # Изменения уведомлений после after_seq: (seq, op, id, chat_id, time, tz)
+        return await self.notifications_db.fetchall('''
+            SELECT c.seq, c.op, c.notification_id, n.chat_id, n.time, n.tz
+            FROM notification_changes c LEFT JOIN notifications n ON n.id = c.notification_id
+            WHERE c.seq > ? ORDER BY c.seq
+        ''', (after_seq,))
+
+    async def prune_notification_changes(self, up_to_seq):
+        # Удаление обработанных записей журнала изменений
+        await self.notifications_db.execute('DELETE FROM notification_changes WHERE seq <= ?', (up_to_seq,))
+
+    async def get_notifications_page(self, after_id=0, before_id=None, limit=20):
+        # Страница уведомлений по ключу id
+        return await self.notifications_db.transaction(self._keyset_page, 'notifications', 'id, chat_id, time, tz', after_id, before_id, limit)
+
+    async def delete_notification(self, notification_id):
+        # Удаление уведомления по id
+        result = await self.notifications_db.execute('DELETE FROM notifications WHERE id = ?', (notification_id,))
+        if result.rowcount:
+            logger.info("Уведомление %s удалено из базы данных", notification_id)
+        return result.rowcount > 0
+
+    async def add_task(self, task):
+        # Добавление задачи в базу данных
+        await self.tasks_db.execute('INSERT INTO tasks (task) VALUES (?)', (task,))
+        self.tasks_version += 1
+        logger.info("Задача '%s' добавлена в базу данных", task)
+
+    async def add_tasks(self, tasks):
+        # Добавление списка задач одной транзакцией
+        count = await self.tasks_db.transaction(self._insert_tasks, [(task,) for task in tasks])
+        if count:
+            self.tasks_version += 1
+        logger.info("Импортировано задач: %s", count)
+        return count
+
+    @staticmethod
+    def _insert_tasks(conn, rows):
+        return conn.executemany('INSERT INTO tasks (task) VALUES (?)', rows).rowcount
+
+    async def get_tasks(self):
+        # Получение всех задач из базы данных
+        return await self.tasks_db.fetchall('SELECT id, task FROM tasks ORDER BY id')
+
+    async def iter_tasks(self, chunk_size=HYDRATION_CHUNK):
+        # Потоковое чтение задач порциями по id
+        last_id = 0
+        while True:
+            rows = await self.tasks_db.fetchall('SELECT id, task FROM tasks WHERE id > ? ORDER BY id LIMIT ?', (last_id, chunk_size))
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    async def search_tasks(self, text, limit=SEARCH_LIMIT):
+        # Поиск задач по словам: (id, фрагмент с отмеченными совпадениями), лучшие совпадения первыми
+        query = fts_query(text)
+        if not query:
+            return []
+        return await self.tasks_db.transaction(self._search_tasks, query, limit)
+
+    @staticmethod
+    def _search_tasks(conn, query, limit):
+        # Подсчет совпадений останавливается на SEARCH_RANK_LIMIT: обход индекса по rowid не читает лишнего
+        matches = conn.execute(
+            'SELECT COUNT(*) FROM (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ? ORDER BY rowid DESC LIMIT ?)',
+            (query, SEARCH_RANK_LIMIT + 1),
+        ).fetchone()[0]
+        order = 'rank' if matches <= SEARCH_RANK_LIMIT else 'rowid DESC'
+        return conn.execute(f'''
+            SELECT rowid, snippet(tasks_fts, 0, ?, ?, '…', ?)
+            FROM tasks_fts WHERE tasks_fts MATCH ? ORDER BY {order} LIMIT ?
+        ''', (MATCH_START, MATCH_END, SNIPPET_TOKENS, query, limit)).fetchall()
+
+    async def sync_tasks_version(self):
+        # Учет изменений задач, сделанных другими процессами
+        if not self.shared:
+            return
+        data_version = (await self.tasks_db.fetchone('PRAGMA data_version'))[0]
+        if data_version != self.tasks_data_version:
+            if self.tasks_data_version is not None:
+                self.tasks_version += 1
+            self.tasks_data_version = data_version
+
+    async def get_tasks_page(self, after_id=0, before_id=None, limit=20):
+        # Страница задач по ключу id
+        return await self.tasks_db.transaction(self._keyset_page, 'tasks', 'id, task', after_id, before_id, limit)
+
+    async def delete_task(self, task_id):
+        # Удаление задачи по id
+        result = await self.tasks_db.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+        if result.rowcount:
+            self.tasks_version += 1
+            logger.info("Задача %s удалена из базы данных", task_id)
+        return result.rowcount > 0
+
+    @staticmethod
+    def _keyset_page(conn, table, columns, after_id, before_id, limit):
+        # Keyset-пагинация: WHERE id > ? ORDER BY id LIMIT ? вместо чтения всей таблицы
+        if before_id is not None:
+            rows = conn.execute(f'SELECT {columns} FROM {table} WHERE id < ? ORDER BY id DESC LIMIT ?', (before_id, limit + 1)).fetchall()
+            has_prev = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_next = True
+        else:
+            rows = conn.execute(f'SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit + 1)).fetchall()
+            has_next = len(rows) > limit
+            rows = rows[:limit]
+            has_prev = after_id > 0 and conn.execute(f'SELECT 1 FROM {table} WHERE id <= ? LIMIT 1', (after_id,)).fetchone() is not None
+        return Page(rows, has_prev, has_next)
+
+    async def add_regress_product(self, name):
+        # Добавление регрессного продакта в базу данных
+        await self.notifications_db.execute('INSERT INTO regress_product (name) VALUES (?)', (name,))
+        logger.info("Регрессный продакт '%s' добавлен в базу данных", name)
+
+    async def get_current_regress_product(self):
+        # Получение текущего регрессного продакта из базы данных
+        result = await self.notifications_db.fetchone('SELECT name FROM regress_product ORDER BY id DESC LIMIT 1')
+        return result[0] if result else None
+
+    async def close(self):
+        await self.tasks_db.close()
+        await self.notifications_db.close()
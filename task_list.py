@@ -0,0 +1,155 @@
+import asyncio
+import csv
+import html
+import io
+import itertools
+import logging
+
+from storage import MATCH_END, MATCH_START
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина сообщения в Telegram
+MESSAGE_LIMIT = 4096
+# Количество строк на странице списка и максимальная длина строки в нем
+PAGE_SIZE = 20
+ITEM_PREVIEW_LIMIT = 180
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    # Разбиение текста на части не длиннее limit, по возможности по границам строк
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+def parse_tasks(data, filename):
+    # Задачи из загруженного файла: CSV (колонка task или первая колонка) или TXT (задача на строку)
+    text = data.decode('utf-8-sig')
+    if not filename.lower().endswith('.csv'):
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    rows = csv.reader(io.StringIO(text))
+    header = next(rows, None)
+    if header is None:
+        return []
+    if 'task' in header:
+        column = header.index('task')
+    else:
+        # Файл без заголовка: первая строка - тоже задача
+        column = 0
+        rows = itertools.chain([header], rows)
+    return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+
+
+async def write_tasks_csv(chunks, file):
+    # Потоковая запись задач в CSV в двоичный файл: при записи в памяти находится только текущая порция строк,
+    # запись каждой порции идет в отдельном потоке, чтобы не блокировать event loop.
+    # Возвращает количество задач и размер файла в байтах; файл возвращается на начало
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    await asyncio.to_thread(writer.writerow, ('id', 'task'))
+    count = 0
+    async for rows in chunks:
+        await asyncio.to_thread(writer.writerows, rows)
+        count += len(rows)
+    size = await asyncio.to_thread(_finish_csv, text)
+    return count, size
+
+
+def _finish_csv(text):
+    # Дописывание буфера и отсоединение обертки: двоичный файл остается открытым
+    text.flush()
+    file = text.detach()
+    size = file.seek(0, io.SEEK_END)
+    file.seek(0)
+    return size
+
+
+def render_task_list(tasks):
+    # Формирование сообщений со списком задач
+    if not tasks:
+        return ("Список задач пуст.",)
+    tasks_list = "\n".join(f"{task_id}. {task}" for task_id, task in tasks)
+    return tuple(split_message(f"Текущие задачи:\n{tasks_list}"))
+
+
+def preview(text, limit=ITEM_PREVIEW_LIMIT):
+    # Укорачивание длинной строки, чтобы страница гарантированно помещалась в одно сообщение
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def render_task_page(page):
+    # Формирование текста страницы списка задач
+    if not page.rows:
+        return "Список задач пуст."
+    tasks_list = "\n".join(f"{task_id}. {preview(task)}" for task_id, task in page.rows)
+    return f"Текущие задачи:\n{tasks_list}"
+
+
+def render_search_results(query, rows):
+    # Результаты поиска задач в HTML: совпадения выделяются жирным
+    if not rows:
+        return f"По запросу «{html.escape(query)}» ничего не найдено."
+    lines = []
+    for task_id, snippet in rows:
+        snippet = preview(snippet)
+        if snippet.count(MATCH_START) > snippet.count(MATCH_END):
+            # Фрагмент обрезан посреди совпадения
+            snippet += MATCH_END
+        snippet = html.escape(snippet).replace(MATCH_START, '<b>').replace(MATCH_END, '</b>')
+        lines.append(f"{task_id}. {snippet}")
+    return "Найденные задачи:\n" + "\n".join(lines)
+
+
+class TaskListCache:
+    def __init__(self, repo):
+        self.repo = repo
+        self.version = None
+        self.messages = None
+        self.lock = asyncio.Lock()
+        self.pages = {}
+        self.pages_version = None
+
+    async def get(self):
+        # Готовые сообщения со списком задач для текущей версии
+        await self.repo.sync_tasks_version()
+        if self.version == self.repo.tasks_version:
+            return self.messages
+        async with self.lock:
+            version = self.repo.tasks_version
+            if self.version != version:
+                # Если список изменится во время чтения, версия снова разойдется и кеш перестроится
+                messages = render_task_list(await self.repo.get_tasks())
+                self.version, self.messages = version, messages
+                logger.info("Кеш списка задач перестроен: версия %s, сообщений %s", version, len(messages))
+        return self.messages
+
+    async def get_page(self, after_id=0, before_id=None):
+        # Страница списка задач; страницы текущей версии кешируются
+        await self.repo.sync_tasks_version()
+        version = self.repo.tasks_version
+        if self.pages_version != version:
+            self.pages = {}
+            self.pages_version = version
+        key = (after_id, before_id)
+        page = self.pages.get(key)
+        if page is None:
+            page = await self.repo.get_tasks_page(after_id, before_id, PAGE_SIZE)
+            if self.pages_version == self.repo.tasks_version == version and len(self.pages) < 256:
+                self.pages[key] = page
+        return page
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+# Сколько обновлений может находиться в работе и в очередях чатов сверх числа воркеров
+UPDATE_BACKLOG = 8
+# Сколько обновлений одного чата может ждать своей очереди; более поздние отбрасываются
+UPDATE_CHAT_BACKLOG = int(os.getenv('UPDATE_CHAT_BACKLOG', '32'))
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Параллельная обработка обновлений: разные чаты обрабатываются одновременно, обновления одного чата - по порядку.
+    # Обновление сначала дожидается своей очереди в чате и только потом занимает воркер,
+    # поэтому длинная очередь одного чата не блокирует остальные
+    def __init__(self, workers=UPDATE_WORKERS, chat_backlog=UPDATE_CHAT_BACKLOG):
+        super().__init__(max_concurrent_updates=workers * UPDATE_BACKLOG)
+        self.workers = workers
+        self.chat_backlog = chat_backlog
+        self.slots = asyncio.Semaphore(workers)
+        # Обновления, выданные очередью в обработку и еще не завершенные (см. BoundedUpdateQueue)
+        self.in_flight = asyncio.Semaphore(self.max_concurrent_updates)
+        # chat_id -> [блокировка, количество обновлений чата в обработке и в очереди]
+        self.chats = {}
+
+    async def process_update(self, update, coroutine):
+        # Замена process_update базового класса: его общий семафор захватывается до очереди чата,
+        # и один чат с длинной очередью занимал бы все разрешения. Здесь общий ресурс - только воркер,
+        # и он занимается после блокировки чата; длина очереди чата ограничена отдельно
+        try:
+            await self.do_process_update(update, coroutine)
+        finally:
+            self.in_flight.release()
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self.slots:
+                await coroutine
+            return
+        entry = self.chats.setdefault(chat.id, [asyncio.Lock(), 0])
+        if entry[1] >= self.chat_backlog:
+            coroutine.close()
+            logger.warning("Очередь обновлений чата %s переполнена, обновление %s отброшено", chat.id, update.update_id)
+            return
+        entry[1] += 1
+        try:
+            async with entry[0], self.slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chats[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class BoundedUpdateQueue(asyncio.Queue):
+    # Очередь входящих обновлений. Application забирает из нее каждое обновление сразу и запускает
+    # обработку в отдельной задаче, поэтому без ограничения очередь никогда не заполняется.
+    # Здесь обновление выдается, только пока в работе меньше max_concurrent_updates обновлений;
+    # остальные ждут в очереди, и при ее переполнении вебхук отвечает 503, а polling ждет свободного места
+    def __init__(self, processor, maxsize=0):
+        super().__init__(maxsize)
+        self.processor = processor
+
+    async def get(self):
+        await self.processor.in_flight.acquire()
+        try:
+            return await super().get()
+        except BaseException:
+            self.processor.in_flight.release()
+            raise
@@ -0,0 +1,87 @@
+import asyncio
+import hmac
+import logging
+import os
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Публичный адрес вебхука; если не задан, бот не регистрирует вебхук в Telegram (локальный запуск)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Обязательный секрет: без него любой, кто может достучаться до порта, мог бы присылать поддельные обновления
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Размер очереди входящих обновлений; при переполнении сервер отвечает 503, и Telegram повторяет доставку
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    def __init__(self, application, secret_token=WEBHOOK_SECRET, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH):
+        if not secret_token:
+            raise ValueError("Для BOT_MODE=webhook необходимо задать WEBHOOK_SECRET")
+        self.application = application
+        self.secret_token = secret_token
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.runner = None
+
+    async def start(self):
+        # Запуск HTTP-сервера вебхука
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.listen, self.port).start()
+        logger.info("Вебхук слушает %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        # Остановка HTTP-сервера вебхука
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def register(self, url):
+        # Регистрация вебхука в Telegram
+        await self.application.bot.set_webhook(url=url, secret_token=self.secret_token, drop_pending_updates=True)
+        logger.info("Вебхук зарегистрирован: %s", url)
+
+    async def handle_update(self, request):
+        # Прием обновления от Telegram и передача его в очередь приложения
+        # Сравнение байтов: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), self.secret_token.encode()):
+            logger.warning("Запрос к вебхуку с неверным секретным токеном")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            # Обновление - JSON-объект; вложенные поля неверного типа de_json сообщает через AttributeError
+            if not isinstance(data, dict):
+                raise TypeError("тело запроса не является объектом")
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.warning("Некорректное тело запроса к вебхуку")
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь входящих обновлений переполнена")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_health(self, request):
+        # Проверка состояния: размер очереди входящих обновлений
+        queue = self.application.update_queue
+        return web.json_response({
+            'status': 'ok' if self.application.running else 'starting',
+            'queue_size': queue.qsize(),
+            'queue_limit': queue.maxsize,
+        })